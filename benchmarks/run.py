@@ -0,0 +1,121 @@
+"""
+Offline benchmarks of ledger loading and report generation on synthetic ledgers
+
+    python -m benchmarks.run --scales 1k,100k --output bench_results.json
+    python -m benchmarks.run --compare old.json new.json
+"""
+import argparse
+from datetime import datetime
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic import LedgerSpec, generate_ledger, generate_market_data
+from src.exchangerateutility import ExchangeRateUtility
+from src.ledger import ColumnarLedger, LedgerLoader, StreamingLedgerLoader
+from src.pricestore import LocalPriceProvider, PriceStore
+from src.transactionprocessor import TransactionProcessor
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+
+def _measure(task, memory):
+    gc.collect()
+    start = time.perf_counter()
+    result = task()
+    elapsed = time.perf_counter() - start
+    peak = None
+    if memory:
+        # Traced in a second run, tracing slows the task down. Objects that already exist are not counted
+        gc.collect()
+        tracemalloc.start()
+        task()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, {"seconds": round(elapsed, 4), "peak_bytes": peak}
+
+def _streamed_count(path):
+    with StreamingLedgerLoader(path) as loader:
+        return sum(1 for _ in loader.get_transactions())
+
+def run_scale(name, transactions, workdir, years, memory=True):
+    # About two transactions (a credit and half the time a debit) per lot
+    spec = LedgerSpec(accounts=4, stocks=max(5, transactions // 20_000), lots=int(transactions / 1.5), years=years)
+    ledger_dir = os.path.join(workdir, name, "ledger")
+    market_dir = os.path.join(workdir, name, "market")
+    generate_market_data(market_dir, generate_ledger(ledger_dir, spec))
+
+    results = {"transactions": transactions, "spec": vars(spec)}
+    loader, results["load"] = _measure(lambda: LedgerLoader(ledger_dir), memory)
+    _, results["load_streaming"] = _measure(lambda: _streamed_count(ledger_dir), memory)
+    _, results["load_columnar"] = _measure(lambda: ColumnarLedger(loader.get_transactions()), memory)
+    results["transactions"] = len(loader.get_transactions())
+
+    def generate_reports():
+        processor = TransactionProcessor(
+            loader.get_accounts(),
+            loader.get_transactions(),
+            exchange_rate_util=ExchangeRateUtility(os.path.join(market_dir, "SBI_REFERENCE_RATES_USD.csv"),
+                                                   cache_dir=None, offline=True),
+            price_store=PriceStore(LocalPriceProvider(market_dir), cache_dir=None)
+        )
+        processor.generate_reports()
+        return processor.timings
+    timings, results["generate_reports"] = _measure(generate_reports, memory)
+    results["generate_reports"].update({phase: round(seconds, 4) for phase, seconds in timings.items()})
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{'scale':<8}{'phase':<20}{'old (s)':>10}{'new (s)':>10}{'ratio':>8}")
+    for scale, phases in new["results"].items():
+        for phase, result in phases.items():
+            if not isinstance(result, dict) or "seconds" not in result:
+                continue
+            previous = old["results"].get(scale, {}).get(phase, {}).get("seconds")
+            ratio = f"{result['seconds'] / previous:.2f}" if previous else "-"
+            print(f"{scale:<8}{phase:<20}{previous or '-':>10}{result['seconds']:>10}{ratio:>8}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1k,100k,1M", help=f"comma separated, out of {', '.join(SCALES)}")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run measuring peak memory")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--workdir", help="where the synthetic ledgers are written, a temporary directory by default")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    output = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for name in args.scales.split(","):
+            print(f"Running {name}")
+            output["results"][name] = run_scale(name, SCALES[name], args.workdir or temp_dir, args.years,
+                                                not args.no_memory)
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(output, f, indent=2)
+    print(json.dumps(output["results"], indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import csv
+import os
+import random
+
+from src.ledger import ACCOUNT_FIELDS, TRANSACTION_FIELDS
+
+@dataclass
+class LedgerSpec:
+    accounts: int = 2
+    stocks: int = 5
+    lots: int = 500
+    years: int = 3
+    # Expected number of splits per stock per year
+    split_frequency: float = 0.1
+    # Share of the lots that are (partly) sold
+    sell_ratio: float = 0.5
+    seed: int = 0
+
+def _business_days(start, end):
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+def _random_day(rng, start, end):
+    return start + timedelta(days=rng.randrange((end - start).days + 1))
+
+def _split_factor(splits, after, until):
+    # Splits are applied before credits and debits of the same day
+    factor = 1
+    for date, ratio in splits:
+        if after < date <= until:
+            factor *= ratio
+    return factor
+
+@dataclass
+class SyntheticLedger:
+    stocks: list
+    # stock -> sorted [(date, ratio)]
+    splits: dict
+    start: datetime
+    end: datetime
+
+def _write_accounts(path, spec):
+    with open(os.path.join(path, "accounts.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(ACCOUNT_FIELDS)
+        for idx in range(spec.accounts):
+            writer.writerow([f"A{idx}", f"XX-{1000 + idx}", "Broker", f"{idx} Main St", "98052", "US", "USD"])
+
+def _generate_transactions(rng, spec, ledger):
+    rows = []
+    for stock in ledger.stocks:
+        for date, ratio in ledger.splits[stock]:
+            rows.append([f"A{rng.randrange(spec.accounts)}", str(date.date()), stock, "-1", "split", ratio, "", ""])
+    for lot_id in range(spec.lots):
+        stock = rng.choice(ledger.stocks)
+        account = f"A{rng.randrange(spec.accounts)}"
+        credit_date = _random_day(rng, ledger.start, ledger.end)
+        units = rng.randrange(1, 100)
+        rows.append([account, str(credit_date.date()), stock, str(lot_id), "credit", units,
+                     round(rng.uniform(10, 500), 2), ""])
+        if rng.random() < spec.sell_ratio and credit_date < ledger.end:
+            debit_date = _random_day(rng, credit_date + timedelta(days=1), ledger.end)
+            balance = units * _split_factor(ledger.splits[stock], credit_date, debit_date)
+            rows.append([account, str(debit_date.date()), stock, str(lot_id), "debit", rng.randrange(1, balance + 1),
+                         "", round(rng.uniform(10, 500), 2)])
+    # Files are not expected to be sorted
+    rng.shuffle(rows)
+    return rows
+
+def generate_ledger(path, spec, end_year=None):
+    """
+    Writes accounts.csv and transactions.csv in the LedgerLoader formats for the CYs up to end_year (default the
+    current CY)
+    """
+    rng = random.Random(spec.seed)
+    end_year = end_year or datetime.now().year
+    today = datetime.now()
+    ledger = SyntheticLedger(
+        stocks=[f"STK{idx:03d}" for idx in range(spec.stocks)],
+        splits={},
+        start=datetime(end_year - spec.years + 1, 1, 1),
+        end=min(datetime(end_year, 12, 31), datetime(today.year, today.month, today.day))
+    )
+    for stock in ledger.stocks:
+        ledger.splits[stock] = sorted((_random_day(rng, ledger.start, ledger.end), rng.choice([2, 3, 4]))
+                                      for _ in range(spec.years) if rng.random() < spec.split_frequency)
+
+    os.makedirs(path, exist_ok=True)
+    _write_accounts(path, spec)
+    with open(os.path.join(path, "transactions.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(TRANSACTION_FIELDS)
+        writer.writerows(_generate_transactions(rng, spec, ledger))
+    return ledger
+
+def generate_market_data(path, ledger, seed=0):
+    """
+    Writes split adjusted daily OHLC files <stock>.csv for LocalPriceProvider and an SBI reference rate table
+    SBI_REFERENCE_RATES_USD.csv, from 40 days before the ledger starts to the end of its last CY
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    first_day = ledger.start - timedelta(days=40)
+    last_day = datetime(ledger.end.year, 12, 31)
+    for stock in ledger.stocks:
+        price = rng.uniform(20, 400)
+        with open(os.path.join(path, f"{stock}.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["Date", "Open", "High", "Low", "Close"])
+            for day in _business_days(first_day, last_day):
+                price = max(1.0, price * rng.uniform(0.97, 1.03))
+                # Like yfinance, prices before a split are divided by it
+                adjusted = price / _split_factor(ledger.splits[stock], day, datetime.max)
+                writer.writerow([str(day.date()), round(adjusted, 4), round(adjusted * 1.01, 4),
+                                 round(adjusted * 0.99, 4), round(adjusted * 1.005, 4)])
+    with open(os.path.join(path, "SBI_REFERENCE_RATES_USD.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["DATE", "PDF_FILE", "TT_BUY", "TT_SELL"])
+        for day in _business_days(min(first_day, datetime(2020, 1, 4)), last_day):
+            rate = round(rng.uniform(70, 90), 2)
+            writer.writerow([f"{day.date()} 09:00", f"{day.date()}.pdf", rate, round(rate + 1, 2)])
@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+import os
+import threading
+
+@contextmanager
+def atomic_write(path):
+    """
+    Opens a temporary file next to path for writing in binary mode and moves it over path once the block completes,
+    so concurrent readers see either the previous file or the complete new one. The directory is created if needed
+    and nothing is left behind when the block fails
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            yield f
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
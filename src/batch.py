@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+import json
+import os
+import time
+import traceback
+
+from . import exchangerateutility, pricestore
+from .exchangerateutility import DEFAULT_CURRENCY, ExchangeRateStore, ExchangeRateUtility
+from .ledger import LedgerLoader
+from .prefetch import Prefetcher
+from .pricestore import PriceStore
+from .transactionprocessor import TransactionProcessor
+
+@dataclass
+class ClientResult:
+    client: str
+    wall_time: float
+    error: str = None
+
+def _write_json(path, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+def write_reports(path, reports_a3, reports_ltcg, reports_stcg):
+    os.makedirs(path, exist_ok=True)
+    _write_json(os.path.join(path, "a3.json"), {
+        year: {lot_id: asdict(report) for lot_id, report in reports.items()} for year, reports in reports_a3.items()
+    })
+    _write_json(os.path.join(path, "ltcg.json"), {fy: [asdict(cg) for cg in cgs] for fy, cgs in reports_ltcg.items()})
+    _write_json(os.path.join(path, "stcg.json"), {fy: [asdict(cg) for cg in cgs] for fy, cgs in reports_stcg.items()})
+
+def _run_client(client_dir, output_dir, rate_path, rate_cache_dir, price_cache_dir, *, # pylint: disable=R0913
+                provider=None, snapshot_path=None):
+    # Runs in a worker process, market data comes from the shared caches or the snapshot only and nothing is fetched.
+    # Each worker still builds its own FX calendar and price frames from the mapped files, only the raw records are
+    # shared through the page cache
+    start = time.perf_counter()
+    client = os.path.basename(client_dir)
+    try:
+        loader = LedgerLoader(client_dir)
+        if snapshot_path is not None:
+            processor = TransactionProcessor(loader.get_accounts(), loader.get_transactions(), snapshot=snapshot_path)
+        else:
+            processor = TransactionProcessor(
+                loader.get_accounts(),
+                loader.get_transactions(),
+                exchange_rate_util=ExchangeRateUtility(rate_path, cache_dir=rate_cache_dir, offline=True),
+                exchange_rate_store=ExchangeRateStore(cache_dir=rate_cache_dir, offline=True),
+                # Same provider as the warm up, each provider has a cache of its own
+                price_store=PriceStore(provider, cache_dir=price_cache_dir, offline=True)
+            )
+        write_reports(os.path.join(output_dir, client), *processor.generate_reports())
+        return ClientResult(client, time.perf_counter() - start)
+    except Exception: # pylint: disable=W0718
+        return ClientResult(client, time.perf_counter() - start, traceback.format_exc())
+
+def _warm_up(clients, provider, rate_path, rate_cache_dir, price_cache_dir):
+    # Fills the shared caches with the prices and the exchange rates of every currency the clients hold. Returns the
+    # results of the clients whose ledger failed to load, they are left out of the pool
+    currencies = set()
+    failed = []
+
+    def transactions():
+        for client in clients:
+            start = time.perf_counter()
+            try:
+                loader = LedgerLoader(client)
+            except Exception: # pylint: disable=W0718
+                failed.append(ClientResult(os.path.basename(client), time.perf_counter() - start,
+                                           traceback.format_exc()))
+                continue
+            currencies.update(account.currency.upper() for account in loader.get_accounts() if account.currency)
+            yield from loader.get_transactions()
+
+    exchange_rate_util = ExchangeRateUtility(rate_path, cache_dir=rate_cache_dir)
+    Prefetcher(PriceStore(provider, price_cache_dir), exchange_rate_util).run(transactions())
+    exchange_rate_store = ExchangeRateStore(cache_dir=rate_cache_dir)
+    for currency in currencies - {DEFAULT_CURRENCY}:
+        exchange_rate_store.get(currency)
+    return failed
+
+def run_batch(clients_dir, output_dir, max_workers=None, *, provider=None, rate_path=None, # pylint: disable=R0913
+              rate_cache_dir=exchangerateutility.CACHE_DIR, price_cache_dir=pricestore.CACHE_DIR, snapshot_path=None):
+    """
+    Generates the reports of every client ledger directory under clients_dir on a process pool sized to the
+    available cores. Market data of all the clients is fetched once into the on-disk caches before the workers start
+    and the workers only read it, each building its own lookup tables from it. Each client's a3/ltcg/stcg JSON is
+    written to output_dir/<client> as soon as it finishes and summary.json lists the wall time and error, if any, of
+    every client. With a snapshot_path every client's market data comes from that MarketSnapshot instead, nothing is
+    fetched
+    """
+    clients = sorted(
+        os.path.join(clients_dir, name) for name in os.listdir(clients_dir)
+        if os.path.isdir(os.path.join(clients_dir, name))
+    )
+    os.makedirs(output_dir, exist_ok=True)
+
+    results = []
+    if snapshot_path is None:
+        results = _warm_up(clients, provider, rate_path, rate_cache_dir, price_cache_dir)
+        for result in results:
+            print(f"Client {result.client} failed:\n{result.error}")
+
+    failed = {result.client for result in results}
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        futures = [
+            executor.submit(_run_client, client, output_dir, rate_path, rate_cache_dir, price_cache_dir,
+                            provider=provider, snapshot_path=snapshot_path)
+            for client in clients if os.path.basename(client) not in failed
+        ]
+        for future in as_completed(futures):
+            result = future.result()
+            if result.error is not None:
+                print(f"Client {result.client} failed:\n{result.error}")
+            results.append(result)
+    results.sort(key=lambda result: result.client)
+    _write_json(os.path.join(output_dir, "summary.json"), [asdict(result) for result in results])
+    return results
@@ -0,0 +1,66 @@
+import hashlib
+import os
+import pickle
+
+from .atomicfile import atomic_write
+
+def _transaction_record(transaction):
+    # The account currency picks the exchange rates of the lot, changing it invalidates the checkpoints as well
+    account = transaction.account
+    currency = account.currency.upper() if account is not None and account.currency else None
+    return repr((transaction.account_id, currency, transaction.date, transaction.stock, transaction.lot_id,
+                 transaction.transaction_type.value, transaction.units, transaction.buy_price,
+                 transaction.sell_price)).encode("utf-8")
+
+def prefix_digests(transactions, first_year, last_year):
+    """
+    Hash of the ledger up to the end of every CY in [first_year, last_year], along with the number of transactions
+    in that prefix. A checkpoint taken at the end of a CY stays valid as long as the digest of that CY does
+    """
+    digests = {}
+    hasher = hashlib.sha256()
+    count = 0
+    year = first_year
+    for transaction in transactions:
+        transaction_year = int(transaction.date.split("-")[0])
+        while year < transaction_year and year <= last_year:
+            digests[year] = (hasher.hexdigest(), count)
+            year += 1
+        hasher.update(_transaction_record(transaction))
+        count += 1
+    while year <= last_year:
+        digests[year] = (hasher.hexdigest(), count)
+        year += 1
+    return digests
+
+class CheckpointStore:
+    """
+    Lot book and reports as of the end of a CY, keyed by the CY and the digest of the ledger up to it
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _path(self, year, digest):
+        return os.path.join(self.path, f"{year}-{digest}.pkl")
+
+    def save(self, year, digest, state):
+        with atomic_write(self._path(year, digest)) as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load(self, year, digest):
+        path = self._path(year, digest)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def find_latest(self, digests):
+        """
+        Latest CY with a valid checkpoint and its state, (None, None) when the ledger has to be replayed from scratch
+        """
+        for year in sorted(digests, reverse=True):
+            state = self.load(year, digests[year][0])
+            if state is not None:
+                return year, state
+        return None, None
@@ -0,0 +1,153 @@
+"""
+Command line entry point, run as python -m src <command> <ledger directory>
+
+    load      summary of the ledger
+    validate  checks the ledger without fetching any market data
+    prefetch  warms the FX and price caches for the ledger
+    snapshot  writes the FX tables and prices the ledger needs to a single file, see src/snapshot.py
+    report    generates the A3, LTCG and STCG reports as JSON, CSV, JSON lines or parquet
+
+Market data modules (numpy, pandas, yfinance) are only imported by the commands that need them, so load and validate
+start quickly even on a cold interpreter
+"""
+import argparse
+
+from .ledger import LedgerLoader, StreamingLedgerLoader, validate_transactions
+
+def _load(args):
+    if args.streaming:
+        return StreamingLedgerLoader(args.ledger)
+    return LedgerLoader(args.ledger)
+
+def _market_data(args, profiler=None):
+    # pylint: disable=C0415
+    from .exchangerateutility import ExchangeRateStore, ExchangeRateUtility
+    from .pricestore import LocalPriceProvider, PriceStore
+    # Rates of a currency are only loaded once the ledger turns out to need them
+    exchange_rate_store = ExchangeRateStore(args.rates_dir, offline=args.offline, profiler=profiler)
+    if args.rates:
+        exchange_rate_store.add("USD", ExchangeRateUtility(args.rates, offline=args.offline, profiler=profiler))
+    if args.prices:
+        # Reading a local directory needs no network, like a local --rates file
+        return exchange_rate_store, PriceStore(LocalPriceProvider(args.prices))
+    return exchange_rate_store, PriceStore(offline=args.offline)
+
+def load(args):
+    loader = _load(args)
+    stocks = set()
+    count = 0
+    first = last = None
+    for transaction in loader.get_transactions():
+        stocks.add(transaction.stock)
+        count += 1
+        first = first or transaction.date
+        last = transaction.date
+    print(f"{len(loader.get_accounts())} accounts, {count} transactions, {len(stocks)} stocks")
+    if count:
+        print(f"From {first} to {last}")
+    return 0
+
+def validate(args):
+    try:
+        loader = _load(args)
+        problems = validate_transactions(loader.get_transactions())
+    except (KeyError, ValueError) as e:
+        problems = [f"Malformed transaction row: {e!r}"]
+    for problem in problems:
+        print(problem)
+    print(f"{len(problems)} problems found")
+    return 1 if problems else 0
+
+def prefetch(args):
+    from .prefetch import Prefetcher # pylint: disable=C0415
+    exchange_rate_store, price_store = _market_data(args)
+    loader = _load(args)
+    for currency in {account.currency or "USD" for account in loader.get_accounts()}:
+        exchange_rate_store.get(currency)
+    prefetcher = Prefetcher(price_store, load_exchange_rates=False)
+    prefetcher.run(loader.get_transactions(), raise_on_failure=False)
+    summary = prefetcher.report
+    for failure in summary.failures:
+        print(f"Failed to fetch {failure}")
+    print(f"{summary.tasks} tasks in {summary.io_wait:.2f}s, {summary.retries} retries, "
+          f"{len(summary.failures)} failures")
+    return 1 if summary.failures else 0
+
+def snapshot(args):
+    from .snapshot import create_snapshot # pylint: disable=C0415
+    exchange_rate_store, price_store = _market_data(args)
+    loader = _load(args)
+    digest = create_snapshot(args.output, loader.get_accounts(), loader.get_transactions(),
+                             exchange_rate_store=exchange_rate_store, price_store=price_store,
+                             current_year=args.year)
+    print(f"Snapshot {digest} written to {args.output}")
+    return 0
+
+def report(args):
+    # pylint: disable=C0415
+    from .batch import write_reports
+    from .checkpoint import CheckpointStore
+    from .profiler import Profiler
+    from .sinks import SINKS
+    from .transactionprocessor import TransactionProcessor
+    profiler = Profiler() if args.profile else None
+    exchange_rate_store = price_store = None
+    if args.snapshot is None:
+        exchange_rate_store, price_store = _market_data(args, profiler)
+    loader = _load(args)
+    # Other than JSON, the reports are streamed to the files CY by CY
+    sink = SINKS[args.format](args.output) if args.format != "json" else None
+    processor = TransactionProcessor(
+        loader.get_accounts(),
+        loader.get_transactions(),
+        exchange_rate_store=exchange_rate_store,
+        price_store=price_store,
+        snapshot=args.snapshot,
+        checkpoint_store=CheckpointStore(args.checkpoints) if args.checkpoints else None,
+        profiler=profiler,
+        sink=sink
+    )
+    if sink is None:
+        write_reports(args.output, *processor.generate_reports())
+    else:
+        with sink:
+            processor.generate_reports()
+    if profiler is not None:
+        profiler.write(args.profile)
+    print(f"Reports written to {args.output}")
+    return 0
+
+def _parser():
+    parser = argparse.ArgumentParser(prog="python -m src", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command, handler in [("load", load), ("validate", validate), ("prefetch", prefetch), ("snapshot", snapshot),
+                             ("report", report)]:
+        subparser = commands.add_parser(command)
+        subparser.set_defaults(handler=handler)
+        subparser.add_argument("ledger", help="directory holding the account and transaction CSV files")
+        subparser.add_argument("--streaming", action="store_true", help="sort the ledger on disk, for large ledgers")
+        if command in ("prefetch", "snapshot", "report"):
+            subparser.add_argument("--rates", help="SBI reference rate CSV, the upstream file by default")
+            subparser.add_argument("--rates-dir", help="directory of SBI_REFERENCE_RATES_<currency>.csv files for the "
+                                   "currencies other than USD, the upstream files by default")
+            subparser.add_argument("--prices", help="directory of <ticker>.csv or .parquet files instead of yfinance")
+            subparser.add_argument("--offline", action="store_true",
+                                   help="use the on-disk caches and the local --rates and --prices files only")
+        if command == "snapshot":
+            subparser.add_argument("--output", default="market.snap")
+            subparser.add_argument("--year", type=int, help="last CY the snapshot covers, the current one by default")
+        if command == "report":
+            subparser.add_argument("--snapshot", help="market data snapshot to use instead of the other sources")
+            subparser.add_argument("--output", default="reports")
+            subparser.add_argument("--format", default="json", choices=["json", "csv", "jsonl", "parquet"])
+            subparser.add_argument("--checkpoints", help="directory of per CY checkpoints to resume from, JSON only")
+            subparser.add_argument("--profile", help="write the profiler report as JSON to this path")
+    return parser
+
+def main(argv=None):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "checkpoints", None) and args.format != "json":
+        parser.error("--checkpoints only works with --format json, streamed reports are not kept in checkpoints")
+    return args.handler(args)
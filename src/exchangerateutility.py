@@ -1,61 +1,293 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-import pandas as pd
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+
+from .atomicfile import atomic_write
 
 PATH_PREFIX = "https://raw.githubusercontent.com"
 REPO_PATH = "sahilgupta/sbi-fx-ratekeeper"
-FILE_PATH = "main/csv_files/SBI_REFERENCE_RATES_USD.csv"
+FILE_PATH = "main/csv_files/SBI_REFERENCE_RATES_{currency}.csv"
+DEFAULT_CURRENCY = "USD"
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tax-return-utility")
+# Cached rates are kept as a flat array of (date ordinal, TT_BUY) records, sorted by date, so it can be memory mapped
+RATE_DTYPE = np.dtype([("date", "<i8"), ("rate", "<f8")])
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+def rate_path(currency):
+    # Upstream SBI reference rate table of a currency, e.g. SBI_REFERENCE_RATES_GBP.csv
+    return f"{PATH_PREFIX}/{REPO_PATH}/{FILE_PATH.format(currency=currency)}"
+
+class RateMemo:
+    """
+    Bounded LRU of resolved (rate, date) pairs with hit and miss counts
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
 
 class ExchangeRateUtility:
 
-    def __init__(self):
-        self.path = f"{PATH_PREFIX}/{REPO_PATH}/{FILE_PATH}"
-        self.date_to_rate = {}
+    def __init__(self, path=None, cache_dir=CACHE_DIR, offline=False, max_age=timedelta(days=1), *, profiler=None, # pylint: disable=R0913
+                 memo_size=1024, rates=None):
+        """
+        path: SBI reference rate CSV, either the URL of the upstream file or a local copy
+        cache_dir: directory of the binary rate cache, None disables caching
+        offline: never access the network nor write the cache, rates come from a local path or else from the cache
+        max_age: a cache of the upstream file younger than this is used as is, an older one is topped up with the rows
+        newer than its last date. A local file is always read unless it is unchanged since it was cached
+        profiler: counts the lookups and how many days back they had to go to the last published rate
+        memo_size: number of months whose month end rate is memoized
+        rates: RATE_DTYPE records used as is instead of reading path or the cache, e.g. the rates of a MarketSnapshot
+        """
+        self.path = path or rate_path(DEFAULT_CURRENCY)
+        self.cache_path = None
+        if cache_dir is not None and rates is None:
+            self.cache_path = os.path.join(cache_dir, self._cache_name())
+        self.offline = offline
+        self.max_age = max_age
+        self.profiler = profiler
+        self.given_rates = rates
+        # Month ("YYYY-MM") -> rate of the last day of the previous month
+        self.memo = RateMemo(memo_size)
+        self.first_ordinal = None
+        self.rates = None
+        self.rate_dates = None
+        self.calendar_idx = None
+        self._calendar_idx = []
+        self._rates = []
+        self._rate_dates = []
+        self._rate_ordinals = []
         self.lower_limit = datetime.strptime("2020-01-04", "%Y-%m-%d")
         self._initialize()
 
-    def _initialize(self):
+    def _is_remote(self):
+        return "://" in self.path
+
+    def _cache_name(self):
+        # Every source has a cache of its own. A local file's is keyed on its modification time and size as well, so
+        # an edited file is never served from the cache of an older version
+        source = self.path
+        if not self._is_remote():
+            stat = os.stat(self.path)
+            source = f"{os.path.abspath(self.path)}:{stat.st_mtime_ns}:{stat.st_size}"
+        name = os.path.splitext(os.path.basename(self.path))[0]
+        return f"{name}-{hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]}.npy"
+
+    def _read_csv(self):
         # DATE PDF_FILE TT_BUY TT_SELL BILL_BUY	BILL_SELL FOREX_TRAVEL_CARD BUY_FOREX_TRAVEL CARD_SELL CN_BUY CN_SELL
         # For inward remittance TT_BUY is taken into account as the bank will buy foreign currency from you at that
         # exchange rate
         # Check page 5 Enhancing Tax Transparency on Foreign Assets and Income.pdf
+        import pandas as pd # pylint: disable=C0415
         df = pd.read_csv(self.path)
+        date_to_rate = {}
         for row in df.itertuples():
             if row is None:
                 continue
-            self.date_to_rate[row.DATE.split(" ")[0]] = row[3]
-
-    def _traverse(self, check, update, temp):
-        rate = None
-        while(rate is None and check(temp)):
-            temp_date = str(temp.date())
-            if temp_date in self.date_to_rate and self.date_to_rate[temp_date] != 0:
-                rate = self.date_to_rate[temp_date]
-                break
-            temp = update(temp)
-        return rate, temp_date
-
-    def _get_last_date_of_previous_month(self, date):
-        date_stamp = datetime.strptime(date, "%Y-%m-%d")
-        first_day_of_current_month = date_stamp.replace(day=1)
-        last_day_of_previous_month = first_day_of_current_month - timedelta(days=1)
-        return str(last_day_of_previous_month.date())
+            date_to_rate[datetime.strptime(row.DATE.split(" ")[0], "%Y-%m-%d").toordinal()] = row[3]
+        rates = np.array(sorted(date_to_rate.items()), dtype=RATE_DTYPE)
+        return rates
 
-    def get_exchange_rate(self, date):
-        if date in self.date_to_rate:
-            return self.date_to_rate[date], date
+    def _read_cache(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return None
+        return np.load(self.cache_path, mmap_mode="r")
+
+    def _write_cache(self, rates):
+        with atomic_write(self.cache_path) as f:
+            np.save(f, rates)
 
-        rate = None
-        date_stamp = datetime.strptime(date, "%Y-%m-%d")
-        temp = date_stamp
+    def _is_fresh(self):
+        return time.time() - os.path.getmtime(self.cache_path) < self.max_age.total_seconds()
 
-        temp = date_stamp - timedelta(days=1)
-        rate, temp_date = self._traverse(lambda temp: temp >= self.lower_limit,
-                                            lambda temp: temp - timedelta(days=1), temp)
+    def _load_rates(self):
+        if self.given_rates is not None:
+            return self.given_rates
+        cached = self._read_cache()
+        if not self._is_remote():
+            # The cache of a local file only saves parsing it again
+            if cached is not None:
+                return cached
+            rates = self._read_csv()
+            if self.cache_path is not None and not self.offline:
+                self._write_cache(rates)
+            return rates
+        if self.offline:
+            if cached is None:
+                assert 0, f"Offline mode requires a local rate file or the cache {self.cache_path}"
+            return cached
+        if cached is not None and self._is_fresh():
+            return cached
 
-        if rate is None:
+        rates = self._read_csv()
+        if cached is not None and len(cached) > 0:
+            # Only rows newer than the last cached date are merged in
+            rates = np.concatenate([cached, rates[rates["date"] > cached["date"][-1]]])
+        if self.cache_path is not None and not self.offline:
+            self._write_cache(rates)
+        return rates
+
+    def _initialize(self):
+        # Dense calendar from self.lower_limit to the last published date, each day holds the index of the last date
+        # on or before it with a valid (non-zero) rate, so every lookup is a single array access
+        rates = self._load_rates()
+        first = self.lower_limit.toordinal()
+        rates = rates[rates["date"] >= first]
+        valid = (rates["rate"] != 0) & ~np.isnan(rates["rate"])
+        days = int(rates["date"][-1]) - first + 1 if len(rates) > 0 else 0
+        calendar_idx = np.full(days, -1, dtype=np.int64)
+        calendar_idx[rates["date"][valid] - first] = np.arange(np.count_nonzero(valid))
+        self.first_ordinal = first
+        self.calendar_idx = np.maximum.accumulate(calendar_idx) if days > 0 else calendar_idx
+        self.rates = np.ascontiguousarray(rates["rate"][valid])
+        self.rate_dates = (rates["date"][valid] - EPOCH_ORDINAL).astype("datetime64[D]")
+        # Plain lists serve the scalar lookups, indexing them is cheaper than indexing numpy arrays
+        self._calendar_idx = self.calendar_idx.tolist()
+        self._rates = self.rates.tolist()
+        self._rate_dates = self.rate_dates.astype(str).tolist()
+        self._rate_ordinals = rates["date"][valid].tolist()
+
+    def records(self):
+        """
+        Valid rates from self.lower_limit on as RATE_DTYPE records, an ExchangeRateUtility given them resolves every
+        date exactly like this one
+        """
+        records = np.empty(len(self.rates), dtype=RATE_DTYPE)
+        records["date"] = self.rate_dates.astype(np.int64) + EPOCH_ORDINAL
+        records["rate"] = self.rates
+        return records
+
+    def _to_ordinals(self, dates):
+        dates = np.asarray(dates)
+        if dates.dtype.kind in "UMO":
+            return dates.astype("datetime64[D]").astype(np.int64) + EPOCH_ORDINAL
+        return dates.astype(np.int64)
+
+    def get_exchange_rates(self, dates):
+        """
+        Batch variant of get_exchange_rate, dates can be ISO date strings, datetime64 or day ordinals. Returns the
+        array of rates and the datetime64[D] array of the dates they were published on
+        """
+        start = time.perf_counter()
+        ordinals = self._to_ordinals(dates)
+        # Dates after the last published rate resolve to the last valid rate
+        offsets = np.minimum(ordinals - self.first_ordinal, len(self.calendar_idx) - 1)
+        idx = np.full(offsets.shape, -1)
+        in_range = offsets >= 0
+        idx[in_range] = self.calendar_idx[offsets[in_range]]
+        if (idx < 0).any():
+            date = datetime.fromordinal(int(ordinals[idx < 0][0])).date()
             assert 0, f"Data not available for the requested date {date}"
+        if self.profiler is not None:
+            self.profiler.count("fx.batch_dates", len(ordinals))
+            # Days each date had to walk back to its published rate
+            rate_ordinals = self.rate_dates[idx].astype(np.int64) + EPOCH_ORDINAL
+            self.profiler.count("fx.walk_steps", int((ordinals - rate_ordinals).sum()))
+            self.profiler.add_time("fx.get_exchange_rates", time.perf_counter() - start)
+        return self.rates[idx], self.rate_dates[idx]
+
+    def _lookup(self, ordinal):
+        offset = min(ordinal - self.first_ordinal, len(self._calendar_idx) - 1)
+        idx = self._calendar_idx[offset] if offset >= 0 else -1
+        if idx < 0:
+            assert 0, f"Data not available for the requested date {datetime.fromordinal(ordinal).date()}"
+        return idx
 
-        return (rate, temp_date)
+    def get_exchange_rate_ordinal(self, ordinal):
+        if self.profiler is not None:
+            start = time.perf_counter()
+            idx = self._lookup(ordinal)
+            self.profiler.count("fx.walk_steps", ordinal - self._rate_ordinals[idx])
+            self.profiler.add_time("fx.get_exchange_rate", time.perf_counter() - start)
+        else:
+            idx = self._lookup(ordinal)
+        return self._rates[idx], self._rate_dates[idx]
+
+    def get_exchange_rate(self, date):
+        return self.get_exchange_rate_ordinal(datetime.fromisoformat(date).toordinal())
+
+    def _get_last_month(self, month):
+        entry = self.memo.get(month)
+        if entry is None:
+            # Last day of the previous month is the day before the first of this month
+            entry = self.get_exchange_rate_ordinal(datetime.fromisoformat(f"{month}-01").toordinal() - 1)
+            self.memo.put(month, entry)
+        return entry
 
     def get_exchange_rate_last_month(self, date):
-        return self.get_exchange_rate(self._get_last_date_of_previous_month(date))
+        # Every date of a month resolves to the same rate, so lookups are memoized per month
+        return self._get_last_month(date[:7])
+
+    def get_exchange_rates_last_month(self, dates):
+        """
+        Batch variant of get_exchange_rate_last_month, the months missing from the memo are resolved in a single
+        lookup and memoized. Returns the list of (rate, date) pairs
+        """
+        months = [date[:7] for date in dates]
+        missing = sorted({month for month in months if month not in self.memo})
+        if missing:
+            month_ends = np.array(missing, dtype="datetime64[M]").astype("datetime64[D]") - 1
+            rates, rate_dates = self.get_exchange_rates(month_ends)
+            for month, rate, rate_date in zip(missing, rates.tolist(), rate_dates.astype(str).tolist()):
+                self.memo.put(month, (rate, rate_date))
+        return [self._get_last_month(month) for month in months]
+
+
+class ExchangeRateStore:
+    """
+    ExchangeRateUtility per currency. A currency's table is only loaded, and cached on disk, the first time it is asked
+    for, then shared by every caller. path is a directory of local tables named like the upstream ones, e.g.
+    SBI_REFERENCE_RATES_GBP.csv, the upstream tables are used when it is None. The other keyword arguments are passed
+    to every ExchangeRateUtility
+    """
+
+    def __init__(self, path=None, **options):
+        self.path = path
+        self.options = options
+        self.utilities = {}
+        self._lock = threading.Lock()
+
+    def add(self, currency, exchange_rate_util):
+        self.utilities[currency.upper()] = exchange_rate_util
+
+    def get(self, currency):
+        currency = currency.upper()
+        with self._lock:
+            if currency not in self.utilities:
+                path = rate_path(currency)
+                if self.path is not None:
+                    path = os.path.join(self.path, os.path.basename(path))
+                self.utilities[currency] = ExchangeRateUtility(path, **self.options)
+            return self.utilities[currency]
@@ -1,8 +1,13 @@
+from array import array
 import csv
+from datetime import datetime
+import heapq
 import os
+import tempfile
 
 from dataclasses import dataclass
 from enum import Enum
+from functools import cached_property
 from typing import List
 
 class TransactionType(Enum):
@@ -28,6 +33,12 @@ class Transaction:
     buy_price: float
     sell_price: float
 
+    @cached_property
+    def ordinal(self):
+        # Day ordinal of the date, parsed on first use only. Not at load time, malformed dates are for validate to
+        # report
+        return datetime.fromisoformat(self.date).toordinal()
+
 @dataclass
 class InvestmentAccount:
     """
@@ -43,6 +54,28 @@ class InvestmentAccount:
     country: str
     currency: str
 
+ACCOUNT_FIELDS = ['account_id', 'account_no', 'broker', 'address', 'zip_code', 'country', 'currency']
+TRANSACTION_FIELDS = ['account_id', 'date', 'stock', 'lot_id', 'transaction_type', 'units', 'buy_price', 'sell_price']
+# Order of the transactions on the same date and stock
+TRANSACTION_TYPE_TO_KEY = {
+    TransactionType.SPLIT: 0,
+    TransactionType.CREDIT: 1,
+    TransactionType.DEBIT: 2
+}
+
+def create_transaction(row):
+    return Transaction(
+        account=None,
+        account_id=row.get('account_id') or -1,
+        date=row['date'],
+        stock=row['stock'],
+        lot_id=row.get('lot_id') or -1,
+        transaction_type=TransactionType[row['transaction_type'].upper()],
+        units=int(row['units']),
+        buy_price=float(row.get('buy_price') or 0.0),
+        sell_price=float(row.get('sell_price') or 0.0)
+    )
+
 class LedgerLoader:
 
     def __init__(self, path):
@@ -53,10 +86,9 @@ class LedgerLoader:
         self._initialize()
 
     def _detect_format(self, header: List[str]) -> str:
-        if header == ['account_id', 'account_no', 'broker', 'address', 'zip_code', 'country', 'currency']:
+        if header == ACCOUNT_FIELDS:
             return 'account'
-        if header == ['account_id', 'date', 'stock', 'lot_id', 'transaction_type', 'units', 'buy_price',
-                        'sell_price']:
+        if header == TRANSACTION_FIELDS:
             return 'transaction'
         return 'unknown'
 
@@ -76,33 +108,17 @@ class LedgerLoader:
 
     def _process_transaction(self, reader):
         for row in reader:
-            transaction = Transaction(
-                account=None,
-                account_id=row.get('account_id') or -1,
-                date=row['date'],
-                stock=row['stock'],
-                lot_id=row.get('lot_id') or -1,
-                transaction_type=TransactionType[row['transaction_type'].upper()],
-                units=int(row['units']),
-                buy_price=float(row.get('buy_price') or 0.0),
-                sell_price=float(row.get('sell_price') or 0.0)
-            )
-            self.transactions.append(transaction)
+            self.transactions.append(create_transaction(row))
 
     def _link_transactions_to_accounts(self, id_to_account):
         for transaction in self.transactions:
             if transaction.account_id in id_to_account:
                 transaction.account = id_to_account[transaction.account_id]
-        transaction_type_to_key = {
-            TransactionType.SPLIT: 0,
-            TransactionType.CREDIT: 1,
-            TransactionType.DEBIT: 2
-        }
         self.transactions.sort(
             key=lambda x: (
                 x.date,
                 x.stock,
-                transaction_type_to_key[x.transaction_type]
+                TRANSACTION_TYPE_TO_KEY[x.transaction_type]
             )
         )
 
@@ -128,3 +144,288 @@ class LedgerLoader:
 
     def get_transactions(self):
         return self.transactions
+
+def _is_date(date):
+    # Only YYYY-MM-DD, dates are split on "-" and sorted as strings. fromisoformat and a bare strptime also accept
+    # forms like 20240315 or 2024-3-15
+    try:
+        return datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") == date
+    except ValueError:
+        return False
+
+def validate_transactions(transactions):
+    """
+    Checks a ledger in order without touching any market data, returns the list of problems found: unknown
+    accounts, malformed dates or units, lots credited twice, debits of unknown lots and debits larger than the lot
+    """
+    problems = []
+    balances = {}
+    lots_by_stock = {}
+    for transaction in transactions:
+        where = f"{transaction.date} {transaction.stock} lot {transaction.lot_id}"
+        if not _is_date(transaction.date):
+            problems.append(f"{where}: invalid date")
+            continue
+        if transaction.account is None:
+            problems.append(f"{where}: unknown account {transaction.account_id}")
+        if transaction.units <= 0:
+            problems.append(f"{where}: units must be positive")
+            continue
+        key = (transaction.stock, transaction.lot_id)
+        if transaction.transaction_type == TransactionType.CREDIT:
+            if balances.get(key):
+                problems.append(f"{where}: credited again while still open")
+            balances[key] = transaction.units
+            lots_by_stock.setdefault(transaction.stock, set()).add(key)
+        elif transaction.transaction_type == TransactionType.DEBIT:
+            balance = balances.get(key)
+            if balance is None:
+                problems.append(f"{where}: debit of a lot that was never credited")
+            elif transaction.units > balance:
+                problems.append(f"{where}: sells {transaction.units} units, only {balance} held")
+            else:
+                balances[key] = balance - transaction.units
+        else:
+            for lot in lots_by_stock.get(transaction.stock, ()):
+                balances[lot] *= transaction.units
+    return problems
+
+def _sort_key(row):
+    # Same order as LedgerLoader, row holds the columns of TRANSACTION_FIELDS
+    return (row[1], row[2], TRANSACTION_TYPE_TO_KEY[TransactionType[row[4].upper()]])
+
+def _read_chunks_csv(path, chunk_size):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        chunk = []
+        for row in reader:
+            # Blank lines, DictReader skips them as well
+            if not row:
+                continue
+            chunk.append(tuple(row))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+def _read_chunks_pandas(path, chunk_size):
+    import pandas as pd # pylint: disable=C0415
+    with pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size) as reader:
+        for frame in reader:
+            yield list(frame.itertuples(index=False, name=None))
+
+def _read_chunks_pyarrow(path, chunk_size):
+    import pyarrow as pa # pylint: disable=C0415,E0401
+    from pyarrow import csv as pa_csv # pylint: disable=C0415,E0401
+    reader = pa_csv.open_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={field: pa.string() for field in TRANSACTION_FIELDS}, strings_can_be_null=False))
+    for batch in reader:
+        columns = [batch.column(idx).to_pylist() for idx in range(len(TRANSACTION_FIELDS))]
+        rows = list(zip(*columns))
+        for idx in range(0, len(rows), chunk_size):
+            yield rows[idx:idx + chunk_size]
+
+CHUNK_READERS = {
+    'csv': _read_chunks_csv,
+    'pandas': _read_chunks_pandas,
+    'pyarrow': _read_chunks_pyarrow,
+}
+
+class TransactionStream:
+    """
+    Re-iterable view over the sorted runs of a StreamingLedgerLoader, every iteration merges the runs from disk and
+    yields the transactions in ledger order
+    """
+
+    def __init__(self, run_paths, id_to_account):
+        self.run_paths = run_paths
+        self.id_to_account = id_to_account
+
+    def _read_run(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.reader(f)
+
+    def __iter__(self):
+        # heapq.merge keeps rows with equal keys in run order, so the result is the same as a stable sort
+        for row in heapq.merge(*[self._read_run(path) for path in self.run_paths], key=_sort_key):
+            transaction = create_transaction(dict(zip(TRANSACTION_FIELDS, row)))
+            transaction.account = self.id_to_account.get(transaction.account_id)
+            yield transaction
+
+class StreamingLedgerLoader(LedgerLoader):
+    """
+    LedgerLoader for ledgers too large to hold in memory. Transaction files are read in chunks of chunk_size rows,
+    each chunk is sorted and spilled to a temporary run file, and get_transactions returns a TransactionStream that
+    merges the runs on the fly. reader picks the CSV parser: 'csv', 'pandas' or 'pyarrow'
+    """
+
+    def __init__(self, path, chunk_size=100_000, reader='csv'):
+        self.chunk_size = chunk_size
+        self.read_chunks = CHUNK_READERS[reader]
+        self.run_dir = tempfile.TemporaryDirectory(prefix="ledger-runs-") # pylint: disable=R1732
+        self.run_paths = []
+        super().__init__(path)
+
+    def _write_run(self, chunk):
+        chunk.sort(key=_sort_key)
+        path = os.path.join(self.run_dir.name, f"{len(self.run_paths)}.csv")
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(chunk)
+        self.run_paths.append(path)
+
+    def _initialize(self):
+        id_to_account = {}
+        for filename in os.listdir(self.path):
+            if not filename.endswith('.csv'):
+                continue
+            path = os.path.join(self.path, filename)
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                fmt = self._detect_format(reader.fieldnames)
+                if fmt == 'account':
+                    self._process_account(reader, id_to_account)
+            if fmt == 'transaction':
+                for chunk in self.read_chunks(path, self.chunk_size):
+                    self._write_run(chunk)
+            elif fmt == 'unknown':
+                print(f"Skipping unknown format file: {filename}")
+        self.transactions = TransactionStream(self.run_paths, id_to_account)
+        self.id_to_account = id_to_account
+
+    def close(self):
+        self.run_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+TRANSACTION_TYPES = list(TransactionType)
+
+class TransactionView:
+    """
+    Read only Transaction backed by a row of a ColumnarLedger
+    """
+    __slots__ = ('ledger', 'idx')
+
+    def __init__(self, ledger, idx):
+        self.ledger = ledger
+        self.idx = idx
+
+    @property
+    def account(self):
+        return self.ledger.accounts[self.ledger.account_ids[self.idx]]
+
+    @property
+    def account_id(self):
+        return self.ledger.account_values[self.ledger.account_ids[self.idx]]
+
+    @property
+    def ordinal(self):
+        return self.ledger.ordinals[self.idx]
+
+    @property
+    def date(self):
+        return self.ledger.get_date(self.ledger.ordinals[self.idx])
+
+    @property
+    def stock(self):
+        return self.ledger.stocks[self.ledger.stock_ids[self.idx]]
+
+    @property
+    def lot_id(self):
+        return self.ledger.lot_values[self.ledger.lot_ids[self.idx]]
+
+    @property
+    def transaction_type(self):
+        return TRANSACTION_TYPES[self.ledger.types[self.idx]]
+
+    @property
+    def units(self):
+        return self.ledger.units[self.idx]
+
+    @property
+    def buy_price(self):
+        return self.ledger.buy_prices[self.idx]
+
+    @property
+    def sell_price(self):
+        return self.ledger.sell_prices[self.idx]
+
+    def to_transaction(self):
+        return Transaction(account=self.account, account_id=self.account_id, date=self.date, stock=self.stock,
+                           lot_id=self.lot_id, transaction_type=self.transaction_type, units=self.units,
+                           buy_price=self.buy_price, sell_price=self.sell_price)
+
+class ColumnarLedger:
+    """
+    Compact, column oriented copy of a ledger. Dates are day ordinals, stocks, lot ids and accounts are interned to
+    integer ids and every column is a typed array, about 40 bytes per transaction. Iterating or indexing yields
+    TransactionView objects that expose the Transaction attributes, numpy views of the columns are available through
+    get_column
+    """
+
+    def __init__(self, transactions):
+        self.ordinals = array('i')
+        self.stock_ids = array('i')
+        self.lot_ids = array('i')
+        self.account_ids = array('i')
+        self.types = array('b')
+        self.units = array('q')
+        self.buy_prices = array('d')
+        self.sell_prices = array('d')
+        self.stocks = []
+        self.lot_values = []
+        self.account_values = []
+        self.accounts = []
+        self._interned = {}
+        self._dates = {}
+        for transaction in transactions:
+            self.append(transaction)
+
+    def _intern(self, kind, value, values):
+        ids = self._interned.setdefault(kind, {})
+        if value not in ids:
+            ids[value] = len(values)
+            values.append(value)
+        return ids[value]
+
+    def append(self, transaction):
+        account_id = self._intern('account', transaction.account_id, self.account_values)
+        if account_id == len(self.accounts):
+            self.accounts.append(transaction.account)
+        self.ordinals.append(transaction.ordinal)
+        self.stock_ids.append(self._intern('stock', transaction.stock, self.stocks))
+        self.lot_ids.append(self._intern('lot', transaction.lot_id, self.lot_values))
+        self.account_ids.append(account_id)
+        self.types.append(TRANSACTION_TYPES.index(transaction.transaction_type))
+        self.units.append(transaction.units)
+        self.buy_prices.append(transaction.buy_price)
+        self.sell_prices.append(transaction.sell_price)
+
+    def get_date(self, ordinal):
+        if ordinal not in self._dates:
+            self._dates[ordinal] = str(datetime.fromordinal(ordinal).date())
+        return self._dates[ordinal]
+
+    def get_column(self, name):
+        import numpy as np # pylint: disable=C0415
+        column = getattr(self, name)
+        return np.frombuffer(column, dtype=column.typecode)
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("ledger index out of range")
+        return TransactionView(self, idx)
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield TransactionView(self, idx)
@@ -0,0 +1,64 @@
+class LotBook:
+    """
+    Lots indexed by stock and lot id. Lots with a non-zero balance are open, a lot whose balance drops to zero is
+    closed but still reported for the CY it was closed in, archive_closed then moves it out so it no longer costs
+    anything in later CYs
+    """
+
+    def __init__(self):
+        # (stock, lot_id) -> Lot for every lot reported in the current CY, in order of creation
+        self.active = {}
+        self.open_by_stock = {}
+        self.closed = {}
+        self.archived = {}
+
+    def __len__(self):
+        return len(self.active)
+
+    def __contains__(self, key):
+        return key in self.active
+
+    def add(self, lot):
+        key = (lot.stock, lot.lot_id)
+        self.archived.pop(key, None)
+        self.active[key] = lot
+        self.refresh(lot)
+        return key
+
+    def get(self, stock, lot_id):
+        key = (stock, lot_id)
+        if key not in self.active and key in self.archived:
+            # Lot sold again after it was archived, bring it back so it is reported
+            self.active[key] = self.archived.pop(key)
+        return self.active[key]
+
+    def refresh(self, lot):
+        """
+        Moves the lot to the open or closed partition after its balance changed
+        """
+        key = (lot.stock, lot.lot_id)
+        open_lots = self.open_by_stock.setdefault(lot.stock, {})
+        if lot.balance == 0:
+            open_lots.pop(key, None)
+            self.closed[key] = lot
+        else:
+            self.closed.pop(key, None)
+            open_lots[key] = lot
+
+    def open_lots(self, stock):
+        return self.open_by_stock.get(stock, {}).items()
+
+    def items(self):
+        return self.active.items()
+
+    def values(self):
+        return self.active.values()
+
+    def archive_closed(self):
+        """
+        Called at the CY boundary, lots closed so far are not reported from the next CY onwards
+        """
+        for key, lot in self.closed.items():
+            self.active.pop(key, None)
+            self.archived[key] = lot
+        self.closed = {}
@@ -0,0 +1,84 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import numpy as np
+
+class SplitFactors:
+    """
+    Piecewise constant split factor of a stock. Prices come adjusted for every split of the ledger, a price times the
+    factor of its day is the price of a unit held on that day. The factor of a day is the product of the splits after
+    it, splits of the day itself are already applied
+    """
+
+    def __init__(self, splits):
+        # splits: (date ordinal, ratio) in date order
+        self.ordinals = [ordinal for ordinal, _ in splits]
+        factors = [1]
+        for _, ratio in reversed(splits):
+            factors.append(factors[-1] * ratio)
+        # factors[i] holds once the first i splits happened, the product of the remaining ones
+        self.factors = factors[::-1]
+        self._ordinals = np.array(self.ordinals, dtype=np.int64)
+        self._factors = np.array(self.factors, dtype=np.float64)
+
+    def factor(self, ordinal):
+        return self.factors[bisect_right(self.ordinals, ordinal)]
+
+    def factors_for(self, ordinals):
+        return self._factors[np.searchsorted(self._ordinals, ordinals, side='right')]
+
+NO_SPLITS = SplitFactors([])
+
+class PeakSeries:
+    """
+    Daily peak prices (INR) of a single stock over one calendar year, laid out as one entry per calendar day. Days
+    without trading carry forward the most recent trading day, same as StockPriceUtility.get_peak_price. Prices are
+    multiplied by the split factor of their calendar day once, when the series is built
+    """
+
+    def __init__(self, stock_price_util, start_date, end_date, split_factors=NO_SPLITS):
+        self.stock = stock_price_util.stock
+        self.start_date = start_date
+        self.end_date = end_date
+        self.days = (end_date - start_date).days + 1
+        self.trading_days = []
+        self.metadata = []
+        self.price_inr = None
+        self.trading_day_idx = None
+        self._initialize(stock_price_util, split_factors)
+
+    def _initialize(self, stock_price_util, split_factors):
+        cut_off = stock_price_util.cut_off.toordinal()
+        self.trading_days = sorted(stock_price_util.date_to_peak_price.keys())
+        peak_prices = [stock_price_util.date_to_peak_price[date] for date in self.trading_days]
+        trading_ordinals = np.array([datetime.strptime(date, "%Y-%m-%d").toordinal() for date in self.trading_days],
+                                    dtype=np.int64)
+        price_inr = np.array([price[0] for price in peak_prices], dtype=np.float64)
+        self.metadata = [(price[1], date, price[2], price[3]) for date, price in zip(self.trading_days, peak_prices)]
+
+        calendar = np.arange(self.days, dtype=np.int64) + self.start_date.toordinal()
+        idx = np.searchsorted(trading_ordinals, calendar, side='right') - 1
+        available = idx >= 0
+        available[available] = trading_ordinals[idx[available]] >= cut_off
+        self.trading_day_idx = np.where(available, idx, -1)
+        self.price_inr = np.full(self.days, np.nan)
+        self.price_inr[available] = price_inr[idx[available]]
+        self.price_inr *= split_factors.factors_for(calendar)
+
+    def get_peak_value(self, balance, start, end):
+        """
+        Peak of round(balance * split adjusted price, 2) over calendar days [start, end) and the metadata of the
+        earliest day reaching it, which is the value the day-by-day comparison with a strict '>' would have kept
+        """
+        prices = self.price_inr[start:end]
+        missing = np.isnan(prices)
+        if missing.any():
+            date = self.start_date + timedelta(days=start + int(np.argmax(missing)))
+            assert 0, f"Stock {self.stock} data not available for the requested date {date.date()}"
+        values = balance * prices
+        best = values.max()
+        peak = round(float(best), 2)
+        # Rounding may tie several days with the maximum, the first of them wins
+        offset = next(offset for offset in np.flatnonzero(values >= best - 0.01)
+                      if round(float(values[offset]), 2) == peak)
+        return peak, self.metadata[self.trading_day_idx[start + offset]]
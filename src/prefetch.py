@@ -0,0 +1,117 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import partial
+import threading
+import time
+
+from .exchangerateutility import ExchangeRateUtility
+from .ledger import TransactionType
+
+@dataclass
+class PrefetchReport:
+    # Wall clock seconds the caller waited for the prefetch stage
+    io_wait: float = 0.0
+    # Sum of the durations of the individual fetches, higher than io_wait when they overlapped
+    fetch_time: float = 0.0
+    tasks: int = 0
+    retries: int = 0
+    failures: list = field(default_factory=list)
+
+def plan_prefetch(transactions, current_year=None, start_year=None):
+    """
+    Works out the (stock, year) pairs generate_reports will need prices for. Once a lot of a stock is credited its
+    prices are needed for every CY up to current_year. CYs before start_year are left out, e.g. when resuming from a
+    checkpoint
+    """
+    current_year = current_year or datetime.now().year
+    first_year = {}
+    for transaction in transactions:
+        if transaction.transaction_type != TransactionType.CREDIT:
+            continue
+        year = int(transaction.date.split("-")[0])
+        first_year[transaction.stock] = min(year, first_year.get(transaction.stock, year))
+    return [(stock, year) for stock, start in first_year.items()
+            for year in range(max(start, start_year or start), current_year + 1)]
+
+class Prefetcher:
+    """
+    Loads the FX table and the prices of every (stock, year) pair a ledger needs on a thread pool before report
+    generation, so network latency is paid concurrently instead of serially inside generate_reports
+    """
+
+    def __init__(self, price_store, exchange_rate_util=None, *, max_workers=8, chunk_size=10, retries=3, # pylint: disable=R0913
+                 backoff=1.0, load_exchange_rates=True):
+        self.price_store = price_store
+        self.exchange_rate_util = exchange_rate_util
+        # USD rates are loaded along with the prices unless given or not needed
+        self.load_exchange_rates = load_exchange_rates and exchange_rate_util is None
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.backoff = backoff
+        self.report = PrefetchReport()
+        self._lock = threading.Lock()
+
+    def _with_retry(self, task, description):
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            try:
+                return task()
+            except Exception: # pylint: disable=W0718
+                if attempt == self.retries:
+                    with self._lock:
+                        self.report.failures.append(description)
+                    raise
+                with self._lock:
+                    self.report.retries += 1
+                time.sleep(self.backoff * 2 ** attempt)
+            finally:
+                with self._lock:
+                    self.report.fetch_time += time.perf_counter() - start
+        return None
+
+    def _price_tasks(self, pairs, current_year):
+        # Years of a stock are contiguous, so a stock needs one range, stocks sharing a range are fetched in chunks
+        first_year = {}
+        for stock, year in pairs:
+            first_year[stock] = min(year, first_year.get(stock, year))
+        stocks_by_year = {}
+        for stock, year in first_year.items():
+            stocks_by_year.setdefault(year, []).append(stock)
+        for year, stocks in sorted(stocks_by_year.items()):
+            # Same 30 days look back as StockPriceUtility
+            start = str((datetime(year, 1, 1) - timedelta(days=30)).date())
+            for idx in range(0, len(stocks), self.chunk_size):
+                yield stocks[idx:idx + self.chunk_size], start, f"{current_year + 1}-01-01"
+
+    def run(self, transactions, current_year=None, start_year=None, *, raise_on_failure=True):
+        """
+        Returns the ExchangeRateUtility to hand to TransactionProcessor along with the warmed up price store. The
+        first task failing all its retries is raised, unless raise_on_failure is False and the failed tasks are only
+        listed in the report
+        """
+        current_year = current_year or datetime.now().year
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            if self.load_exchange_rates:
+                futures.append(executor.submit(self._with_retry, ExchangeRateUtility, "exchange rates"))
+            for stocks, start_date, end_date in self._price_tasks(plan_prefetch(transactions, current_year, start_year),
+                                                                   current_year):
+                futures.append(executor.submit(self._with_retry,
+                                               partial(self.price_store.prefetch, stocks, start_date, end_date),
+                                               f"prices {','.join(stocks)}"))
+            self.report.tasks = len(futures)
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception: # pylint: disable=W0718
+                    if raise_on_failure:
+                        raise
+                    results.append(None)
+        if self.load_exchange_rates:
+            self.exchange_rate_util = results[0]
+        self.report.io_wait = time.perf_counter() - start
+        return self.exchange_rate_util
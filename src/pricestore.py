@@ -0,0 +1,238 @@
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from .atomicfile import atomic_write
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "tax-return-utility", "prices")
+COLUMNS = ["Open", "High", "Low", "Close"]
+# Cached history of a ticker is a flat array of daily records sorted by date, so it can be memory mapped
+PRICE_DTYPE = np.dtype([("date", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8")])
+
+class PriceProvider:
+    """
+    Source of daily OHLC history. fetch returns a DataFrame per ticker indexed by date with the columns
+    Open, High, Low and Close for the dates in [start, end)
+    """
+
+    def fetch(self, tickers, start, end):
+        raise NotImplementedError
+
+    def cache_key(self):
+        # Name of the directory PriceStore caches this provider's prices in, providers never share a cache
+        return type(self).__name__
+
+    def revised_since(self, ticker, fetched): # pylint: disable=W0613
+        """
+        Whether the history of the ticker cached at the POSIX timestamp fetched may have changed since, e.g. adjusted
+        for a later split or dividend. PriceStore then fetches the whole cached range again
+        """
+        return False
+
+class YFinanceProvider(PriceProvider):
+
+    def fetch(self, tickers, start, end):
+        # Imported here so offline providers work without yfinance installed
+        import yfinance as yf # pylint: disable=C0415
+        data = yf.download(list(tickers), start=start, end=end, interval="1d", group_by="ticker",
+                           auto_adjust=True, actions=False, progress=False)
+        histories = {}
+        for ticker in tickers:
+            if not isinstance(data.columns, pd.MultiIndex):
+                history = data
+            elif ticker in data.columns.get_level_values(0):
+                history = data[ticker]
+            else:
+                history = pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name="Date"))
+            histories[ticker] = history[COLUMNS].dropna(how="all")
+        return histories
+
+    def cache_key(self):
+        return "yfinance"
+
+    def revised_since(self, ticker, fetched):
+        # Prices are adjusted, every split or dividend from the day of the fetch on changes the earlier ones
+        import yfinance as yf # pylint: disable=C0415
+        actions = yf.Ticker(ticker).actions
+        if actions is None or len(actions) == 0:
+            return False
+        return actions.index.max().date() >= datetime.fromtimestamp(fetched).date()
+
+class LocalPriceProvider(PriceProvider):
+    """
+    Reads <ticker>.csv or <ticker>.parquet files with the columns Date, Open, High, Low and Close from a directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, ticker):
+        path = os.path.join(self.path, ticker)
+        for extension in ["parquet", "csv"]:
+            if os.path.exists(f"{path}.{extension}"):
+                return f"{path}.{extension}"
+        return None
+
+    def _read(self, ticker):
+        path = self._file(ticker)
+        if path is None:
+            assert 0, f"Stock {ticker} data not available in {self.path}"
+        return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+
+    def cache_key(self):
+        return f"local-{hashlib.sha256(os.path.abspath(self.path).encode('utf-8')).hexdigest()[:16]}"
+
+    def revised_since(self, ticker, fetched):
+        path = self._file(ticker)
+        return path is not None and os.path.getmtime(path) > fetched
+
+    def fetch(self, tickers, start, end):
+        histories = {}
+        for ticker in tickers:
+            history = self._read(ticker)
+            history = history.set_index(pd.to_datetime(history["Date"]).rename("Date"))[COLUMNS]
+            histories[ticker] = history[(history.index >= start) & (history.index < end)]
+        return histories
+
+class PriceStore:
+    """
+    On-disk cache of daily OHLC history in front of a PriceProvider. Each ticker keeps the contiguous date range it
+    has already been fetched for, only the dates outside of it are requested, and tickers missing the same range are
+    fetched together in one request. Each provider has a cache directory of its own, and a ticker the provider
+    reports as revised since it was cached, e.g. by a split, is fetched again in full
+    """
+
+    def __init__(self, provider=None, cache_dir=CACHE_DIR, offline=False, max_age=timedelta(days=1)):
+        """
+        offline: serve only what is already cached, nothing is fetched or written. Used by workers sharing a cache
+        warmed up by another process
+        max_age: the provider is asked whether a cached ticker was revised at most once per max_age, like the
+        exchange rate cache the prices are otherwise used as is
+        """
+        self.provider = provider or YFinanceProvider()
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.max_age = max_age
+        self.prices = {}
+        self.coverage = {}
+        # POSIX timestamp of the fetch the oldest cached prices of each ticker came from
+        self.fetched = {}
+        # POSIX timestamp each ticker was last checked for revisions, or fetched in full
+        self.checked = {}
+
+    def add(self, ticker, prices, coverage):
+        """
+        Serves the PRICE_DTYPE records of a ticker covering [coverage[0], coverage[1]) day ordinals, e.g. from a
+        MarketSnapshot
+        """
+        self.prices[ticker] = prices
+        self.coverage[ticker] = tuple(coverage)
+        self.fetched[ticker] = self.checked[ticker] = time.time()
+
+    def _path(self, ticker, extension):
+        return os.path.join(self.cache_dir, self.provider.cache_key(), f"{ticker.replace(os.sep, '_')}.{extension}")
+
+    def _load(self, ticker):
+        if ticker in self.prices:
+            return
+        self.prices[ticker] = np.empty(0, dtype=PRICE_DTYPE)
+        self.coverage[ticker] = None
+        if self.cache_dir is None or not os.path.exists(self._path(ticker, "json")):
+            return
+        with open(self._path(ticker, "json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        self.coverage[ticker] = tuple(metadata["coverage"])
+        self.fetched[ticker] = metadata["fetched"]
+        self.checked[ticker] = metadata.get("checked", metadata["fetched"])
+        self.prices[ticker] = np.load(self._path(ticker, "npy"), mmap_mode="r")
+
+    def _save_metadata(self, ticker):
+        # Today's prices may still change, so the range is only persisted as covered up to yesterday
+        coverage = self.coverage[ticker]
+        coverage = (coverage[0], min(coverage[1], datetime.now().toordinal()))
+        with atomic_write(self._path(ticker, "json")) as f:
+            f.write(json.dumps({"coverage": coverage, "fetched": self.fetched[ticker],
+                                "checked": self.checked[ticker]}).encode("utf-8"))
+
+    def _save(self, ticker):
+        with atomic_write(self._path(ticker, "npy")) as f:
+            np.save(f, self.prices[ticker])
+        self._save_metadata(ticker)
+
+    def _missing(self, ticker, start, end):
+        self._load(ticker)
+        coverage = self.coverage[ticker]
+        if self.offline:
+            return []
+        if coverage is not None and time.time() - self.checked[ticker] >= self.max_age.total_seconds():
+            self.checked[ticker] = time.time()
+            if self.provider.revised_since(ticker, self.fetched[ticker]):
+                # Cached prices are on an older adjustment basis, the whole range is fetched again
+                start, end = min(start, coverage[0]), max(end, coverage[1])
+                self.prices[ticker] = np.empty(0, dtype=PRICE_DTYPE)
+                self.coverage[ticker] = coverage = None
+            elif self.cache_dir is not None:
+                # Stays unchecked for max_age, in later runs as well
+                self._save_metadata(ticker)
+        if coverage is None:
+            return [(start, end)] if start < end else []
+        # Gaps are fetched as well so the covered range stays contiguous
+        missing = []
+        if start < coverage[0]:
+            missing.append((start, coverage[0]))
+        if end > coverage[1]:
+            missing.append((coverage[1], end))
+        return missing
+
+    def _merge(self, ticker, history, start, end):
+        dates = np.array([timestamp.toordinal() for timestamp in history.index], dtype=np.int64)
+        in_range = (dates >= start) & (dates < end)
+        records = np.empty(np.count_nonzero(in_range), dtype=PRICE_DTYPE)
+        records["date"] = dates[in_range]
+        for column in COLUMNS:
+            records[column.lower()] = history[column].to_numpy(dtype=np.float64)[in_range]
+        prices = self.prices[ticker]
+        prices = prices[(prices["date"] < start) | (prices["date"] >= end)]
+        prices = np.concatenate([prices, records])
+        self.prices[ticker] = prices[np.argsort(prices["date"], kind="stable")]
+        coverage = self.coverage[ticker]
+        if coverage is None:
+            self.fetched[ticker] = self.checked[ticker] = time.time()
+        self.coverage[ticker] = (start, end) if coverage is None else (min(start, coverage[0]), max(end, coverage[1]))
+
+    def prefetch(self, tickers, start, end):
+        """
+        Makes sure the history of all the tickers over [start, end) is cached, dates are "%Y-%m-%d" strings
+        """
+        start = datetime.strptime(start, "%Y-%m-%d").toordinal()
+        end = datetime.strptime(end, "%Y-%m-%d").toordinal()
+        pending = {}
+        for ticker in dict.fromkeys(tickers):
+            for missing in self._missing(ticker, start, end):
+                pending.setdefault(missing, []).append(ticker)
+        for (missing_start, missing_end), missing_tickers in pending.items():
+            histories = self.provider.fetch(missing_tickers, str(datetime.fromordinal(missing_start).date()),
+                                            str(datetime.fromordinal(missing_end).date()))
+            for ticker in missing_tickers:
+                self._merge(ticker, histories[ticker], missing_start, missing_end)
+        if self.cache_dir is not None:
+            for ticker in {ticker for missing_tickers in pending.values() for ticker in missing_tickers}:
+                self._save(ticker)
+
+    def get_history(self, ticker, start, end):
+        """
+        Daily history over [start, end) in the shape of yfinance's Ticker.history, a DataFrame indexed by Date with
+        the columns Open, High, Low and Close
+        """
+        self.prefetch([ticker], start, end)
+        prices = self.prices[ticker]
+        lo, hi = np.searchsorted(prices["date"], [datetime.strptime(start, "%Y-%m-%d").toordinal(),
+                                                  datetime.strptime(end, "%Y-%m-%d").toordinal()])
+        prices = prices[lo:hi]
+        index = pd.DatetimeIndex([datetime.fromordinal(ordinal) for ordinal in prices["date"].tolist()], name="Date")
+        return pd.DataFrame({column: prices[column.lower()] for column in COLUMNS}, index=index)
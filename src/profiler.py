@@ -0,0 +1,59 @@
+from contextlib import contextmanager
+import json
+import time
+
+class Profiler:
+    """
+    Opt-in counters and timers for the hot paths. TransactionProcessor, ExchangeRateUtility and StockPriceUtility take
+    an optional profiler and skip all the bookkeeping when it is None
+    """
+
+    def __init__(self):
+        self.counters = {}
+        # name -> [calls, seconds]
+        self.timers = {}
+        # CY -> phase -> seconds
+        self.years = {}
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_time(self, name, seconds):
+        timer = self.timers.setdefault(name, [0, 0.0])
+        timer[0] += 1
+        timer[1] += seconds
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    @contextmanager
+    def phase(self, year, name):
+        """
+        Times a phase of generate_reports for the given CY, totals across CYs are kept under the timer phase.<name>
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            phases = self.years.setdefault(year, {})
+            phases[name] = phases.get(name, 0.0) + elapsed
+            self.add_time(f"phase.{name}", elapsed)
+
+    def report(self):
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: {"calls": calls, "seconds": round(seconds, 6)}
+                       for name, (calls, seconds) in self.timers.items()},
+            "years": {str(year): {name: round(seconds, 6) for name, seconds in phases.items()}
+                      for year, phases in self.years.items()},
+        }
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
@@ -0,0 +1,157 @@
+from dataclasses import asdict, fields
+import csv
+import json
+import os
+from typing import get_type_hints
+
+# Column holding the period of a record, A3 reports are per CY and capital gains per FY
+PERIOD_COLUMN = {"a3": "year", "ltcg": "fy", "stcg": "fy"}
+
+def _flat_row(kind, period, lot_id, record):
+    # Metadata tuples are spread over one column per item, e.g. peak_value_metadata_0
+    row = {PERIOD_COLUMN[kind]: period, "lot_id": lot_id}
+    for field in fields(record):
+        value = getattr(record, field.name)
+        if isinstance(value, tuple):
+            row.update({f"{field.name}_{idx}": item for idx, item in enumerate(value)})
+        else:
+            row[field.name] = value
+    return row
+
+class ReportSink:
+    """
+    Receives the report records as generate_reports produces them, capital gains as the debits are processed and
+    the A3 rows of a CY once the CY is done. kind is "a3", "ltcg" or "stcg", period is the CY of an A3 row and the FY
+    of a capital gain. flush is called at the end of every CY
+    """
+
+    def write(self, kind, period, lot_id, record):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class CallbackSink(ReportSink):
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, kind, period, lot_id, record):
+        self.callback(kind, period, lot_id, record)
+
+class _FileSink(ReportSink): # pylint: disable=W0223
+    # One file per kind under path, opened when its first record arrives
+    extension = None
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, kind):
+        if kind not in self.files:
+            self.files[kind] = open(os.path.join(self.path, f"{kind}.{self.extension}"), "w", newline="", # pylint: disable=R1732
+                                    encoding="utf-8")
+        return self.files[kind]
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        super().close()
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+class CsvSink(_FileSink):
+    """
+    Writes a3.csv, ltcg.csv and stcg.csv, with the metadata tuples spread over one column per item
+    """
+    extension = "csv"
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.writers = {}
+
+    def write(self, kind, period, lot_id, record):
+        row = _flat_row(kind, period, lot_id, record)
+        if kind not in self.writers:
+            self.writers[kind] = csv.DictWriter(self._file(kind), fieldnames=list(row))
+            self.writers[kind].writeheader()
+        self.writers[kind].writerow(row)
+
+class JsonLinesSink(_FileSink):
+    """
+    Writes a3.jsonl, ltcg.jsonl and stcg.jsonl, one JSON object per record
+    """
+    extension = "jsonl"
+
+    def write(self, kind, period, lot_id, record):
+        row = {PERIOD_COLUMN[kind]: period, "lot_id": lot_id, **asdict(record)}
+        self._file(kind).write(json.dumps(row) + "\n")
+
+def _arrow_schema(kind, period, lot_id, record):
+    # Numbers are float64 unless the record declares them int, so a value that happens to be a whole number in the
+    # first row group does not turn the column into int64
+    import pyarrow as pa # pylint: disable=C0415,E0401
+    hints = get_type_hints(type(record))
+    columns = []
+    for name, value in _flat_row(kind, period, lot_id, record).items():
+        if isinstance(value, str):
+            columns.append((name, pa.string()))
+        elif name == PERIOD_COLUMN[kind] or hints.get(name) is int:
+            columns.append((name, pa.int64()))
+        else:
+            columns.append((name, pa.float64()))
+    return pa.schema(columns)
+
+class ParquetSink(ReportSink):
+    """
+    Writes a3.parquet, ltcg.parquet and stcg.parquet with pyarrow, the records of a CY are buffered and written out
+    as a row group on flush
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}
+        self.schemas = {}
+        self.writers = {}
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, kind, period, lot_id, record):
+        if kind not in self.schemas:
+            self.schemas[kind] = _arrow_schema(kind, period, lot_id, record)
+        self.rows.setdefault(kind, []).append(_flat_row(kind, period, lot_id, record))
+
+    def flush(self):
+        import pyarrow as pa # pylint: disable=C0415,E0401
+        from pyarrow import parquet as pq # pylint: disable=C0415,E0401
+        for kind, rows in self.rows.items():
+            if not rows:
+                continue
+            if kind not in self.writers:
+                self.writers[kind] = pq.ParquetWriter(os.path.join(self.path, f"{kind}.parquet"), self.schemas[kind])
+            self.writers[kind].write_table(pa.Table.from_pylist(rows, schema=self.schemas[kind]))
+            rows.clear()
+
+    def close(self):
+        super().close()
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+
+SINKS = {
+    "csv": CsvSink,
+    "jsonl": JsonLinesSink,
+    "parquet": ParquetSink,
+}
@@ -0,0 +1,164 @@
+"""
+Read-only market data snapshot, a single file holding the exchange rates of every currency and the daily OHLC
+history of every stock a ledger needs. Reports generated from a snapshot never touch the network, so they can be
+reproduced exactly later on, and the file is memory mapped so repeated runs and parallel workers share its pages
+
+Layout, little endian:
+
+    8 bytes    MAGIC
+    8 bytes    length of the header
+    header     UTF-8 JSON with the format version, the record dtypes and per currency / ticker the offset and count
+               of its records relative to the start of the data
+    data       RATE_DTYPE and PRICE_DTYPE records, each block starting at a multiple of ALIGNMENT
+"""
+from datetime import datetime, timedelta
+import hashlib
+import json
+
+import numpy as np
+
+from .atomicfile import atomic_write
+from .exchangerateutility import DEFAULT_CURRENCY, RATE_DTYPE, ExchangeRateStore, ExchangeRateUtility, rate_path
+from .prefetch import Prefetcher, plan_prefetch
+from .pricestore import PRICE_DTYPE, PriceStore
+
+MAGIC = b"TRUSNAP\x00"
+VERSION = 1
+ALIGNMENT = 64
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+def _price_ranges(transactions, current_year):
+    # Same range per stock as the Prefetcher, 30 days before its first CY up to the end of current_year
+    first_year = {}
+    for stock, year in plan_prefetch(transactions, current_year):
+        first_year[stock] = min(year, first_year.get(stock, year))
+    end = datetime(current_year + 1, 1, 1).toordinal()
+    return {stock: ((datetime(year, 1, 1) - timedelta(days=30)).toordinal(), end)
+            for stock, year in sorted(first_year.items())}
+
+def _price_records(price_store, stock, start, end, entry):
+    # Records of the stock over [start, end), clipped to what the store covers
+    coverage = price_store.coverage.get(stock)
+    if coverage is None:
+        assert 0, f"Stock {stock} data not available"
+    entry["coverage"] = [max(start, coverage[0]), min(end, coverage[1])]
+    prices = price_store.prices[stock]
+    lo, hi = np.searchsorted(prices["date"], entry["coverage"])
+    return prices[lo:hi]
+
+def _write(path, header, blocks):
+    data_size = 0
+    for entry, records in blocks:
+        entry["offset"] = data_size
+        entry["count"] = len(records)
+        data_size += records.nbytes + _padding(records.nbytes)
+    # The digest only covers the records, snapshots of the same market data share it whenever they were created
+    hasher = hashlib.sha256()
+    for _, records in blocks:
+        hasher.update(np.ascontiguousarray(records).tobytes())
+    header["digest"] = hasher.hexdigest()
+    encoded = json.dumps(header, sort_keys=True).encode("utf-8")
+    encoded += b" " * _padding(len(MAGIC) + 8 + len(encoded))
+
+    with atomic_write(path) as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, "little"))
+        f.write(encoded)
+        for _, records in blocks:
+            f.write(np.ascontiguousarray(records).tobytes())
+            f.write(b"\0" * _padding(records.nbytes))
+    return header["digest"]
+
+def create_snapshot(path, accounts, transactions, *, exchange_rate_store=None, price_store=None, # pylint: disable=R0913
+                    current_year=None):
+    """
+    Fetches, or takes from the caches, the rates of every currency of the accounts and the prices every stock of the
+    ledger needs up to the end of current_year, and writes them to a snapshot at path. Returns its digest
+    """
+    current_year = current_year or datetime.now().year
+    exchange_rate_store = exchange_rate_store or ExchangeRateStore()
+    price_store = price_store or PriceStore()
+    header = {"version": VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+              "current_year": current_year, "dtypes": {"rate": RATE_DTYPE.descr, "price": PRICE_DTYPE.descr},
+              "exchange_rates": {}, "prices": {}}
+    blocks = []
+
+    currencies = {DEFAULT_CURRENCY} | {account.currency.upper() for account in accounts if account.currency}
+    for currency in sorted(currencies):
+        header["exchange_rates"][currency] = {}
+        blocks.append((header["exchange_rates"][currency], exchange_rate_store.get(currency).records()))
+
+    Prefetcher(price_store, load_exchange_rates=False).run(transactions, current_year)
+    for stock, (start, end) in _price_ranges(transactions, current_year).items():
+        entry = header["prices"][stock] = {}
+        blocks.append((entry, _price_records(price_store, stock, start, end, entry)))
+    return _write(path, header, blocks)
+
+class MarketSnapshot:
+    """
+    Memory mapped snapshot written by create_snapshot. The records are views into the mapping, nothing is parsed
+    beyond the header
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(self.buffer[:len(MAGIC)]) != MAGIC:
+            assert 0, f"{path} is not a market data snapshot"
+        size = int.from_bytes(bytes(self.buffer[len(MAGIC):len(MAGIC) + 8]), "little")
+        self.data_offset = len(MAGIC) + 8 + size
+        self.header = json.loads(bytes(self.buffer[len(MAGIC) + 8:self.data_offset]).decode("utf-8"))
+        if self.header["version"] != VERSION:
+            assert 0, f"Snapshot version {self.header['version']} of {path} is not supported, expected {VERSION}"
+        if self.header["dtypes"] != json.loads(json.dumps({"rate": RATE_DTYPE.descr, "price": PRICE_DTYPE.descr})):
+            assert 0, f"Snapshot {path} has an unexpected record layout"
+        self.digest = self.header["digest"]
+        self.current_year = self.header["current_year"]
+
+    def _records(self, entry, dtype):
+        start = self.data_offset + entry["offset"]
+        return self.buffer[start:start + entry["count"] * dtype.itemsize].view(dtype)
+
+    def currencies(self):
+        return list(self.header["exchange_rates"])
+
+    def tickers(self):
+        return list(self.header["prices"])
+
+    def rates(self, currency):
+        entry = self.header["exchange_rates"].get(currency.upper())
+        if entry is None:
+            assert 0, f"Exchange rates of {currency} are not in the snapshot {self.path}"
+        return self._records(entry, RATE_DTYPE)
+
+    def prices(self, ticker):
+        entry = self.header["prices"].get(ticker)
+        if entry is None:
+            assert 0, f"Stock {ticker} is not in the snapshot {self.path}"
+        return self._records(entry, PRICE_DTYPE), tuple(entry["coverage"])
+
+    def verify(self):
+        """
+        Checks the records against the digest, which reads the whole file
+        """
+        hasher = hashlib.sha256()
+        for entry, dtype in [(entry, RATE_DTYPE) for entry in self.header["exchange_rates"].values()] + \
+                            [(entry, PRICE_DTYPE) for entry in self.header["prices"].values()]:
+            hasher.update(self._records(entry, dtype).tobytes())
+        return hasher.hexdigest() == self.digest
+
+    def exchange_rate_store(self, profiler=None):
+        # Offline without a cache, a currency missing from the snapshot fails instead of being downloaded
+        exchange_rate_store = ExchangeRateStore(cache_dir=None, offline=True, profiler=profiler)
+        for currency in self.currencies():
+            exchange_rate_store.add(currency, ExchangeRateUtility(rate_path(currency), cache_dir=None, offline=True,
+                                                                  profiler=profiler, rates=self.rates(currency)))
+        return exchange_rate_store
+
+    def price_store(self):
+        price_store = PriceStore(cache_dir=None, offline=True)
+        for ticker in self.tickers():
+            price_store.add(ticker, *self.prices(ticker))
+        return price_store
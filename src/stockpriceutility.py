@@ -1,18 +1,25 @@
 from datetime import datetime, timedelta
-
-import yfinance as yf
+import time
 
 class StockPriceUtility:
 
-    def __init__(self, stock, start_date, end_date, exchange_rate_util):
+    def __init__(self, stock, start_date, end_date, exchange_rate_util, price_store=None, *, # pylint: disable=R0913
+                 profiler=None):
 
-        self.ticker = yf.Ticker(stock)
+        # History comes from the price store when one is given, otherwise straight from yfinance
+        self.price_store = price_store
+        self.ticker = stock
+        if price_store is None:
+            # Imported on demand, yfinance pulls in pandas and takes a while to import
+            import yfinance as yf # pylint: disable=C0415
+            self.ticker = yf.Ticker(stock)
         self.stock = stock
         self.start_date = start_date
         self.end_date = end_date
         self.cut_off = None
         self.closing_price = None
         self.exchange_rate_util = exchange_rate_util
+        self.profiler = profiler
         self.date_to_peak_price = {}
         self.date_to_open_price = {}
         self._initialize()
@@ -21,21 +28,27 @@ class StockPriceUtility:
         # Query 30 days prior data, in case data for self.start_date and prior isn't available for some reason
         self.cut_off = datetime.strptime(self.start_date, "%Y-%m-%d") - timedelta(days=30)
         end_date_excluded = datetime.strptime(self.end_date, "%Y-%m-%d") + timedelta(days=1)
-        history = self.ticker.history(
-            start=str(self.cut_off.date()),
-            end=str(end_date_excluded.date()),
-            interval="1d"
-        )
+        start = time.perf_counter()
+        if self.price_store is not None:
+            history = self.price_store.get_history(self.stock, str(self.cut_off.date()), str(end_date_excluded.date()))
+        else:
+            history = self.ticker.history(
+                start=str(self.cut_off.date()),
+                end=str(end_date_excluded.date()),
+                interval="1d"
+            )
+        if self.profiler is not None:
+            self.profiler.count("stock_price_util.constructions")
+            self.profiler.add_time("stock_price_util.fetch", time.perf_counter() - start)
         rows = history.reset_index().to_dict(orient='records')
         if len(rows) == 0:
             assert 0, f"Stock {self.ticker} data not available for the given date range"
 
-        for row in rows:
-            date = str(row['Date'].date())
-            row['High'] = row['High']
-            row['Open'] = row['Open']
-            row['Close'] = row['Close']
-            exchange_rate, date_exchange_rate = self.exchange_rate_util.get_exchange_rate(date)
+        # Convert the whole range in one lookup
+        dates = [str(row['Date'].date()) for row in rows]
+        exchange_rates, dates_exchange_rate = self.exchange_rate_util.get_exchange_rates(dates)
+        for row, date, exchange_rate, date_exchange_rate in zip(rows, dates, exchange_rates.tolist(), \
+                                                                dates_exchange_rate.astype(str).tolist()):
             price_inr = row['High'] * exchange_rate
             self.date_to_peak_price[date] = (price_inr, row['High'], exchange_rate, date_exchange_rate)
             self.date_to_open_price[date] = (row['Open'] * exchange_rate, row['Open'], exchange_rate, date)
@@ -1,8 +1,15 @@
+from contextlib import nullcontext
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime
+import time
 from dateutil.relativedelta import relativedelta
-from .exchangerateutility import ExchangeRateUtility
+from .checkpoint import prefix_digests
+from .exchangerateutility import DEFAULT_CURRENCY, ExchangeRateStore, ExchangeRateUtility
 from .ledger import TransactionType
+from .lotbook import LotBook
+from .peakengine import NO_SPLITS, PeakSeries, SplitFactors
+from .prefetch import Prefetcher
+from .sinks import CallbackSink
 from .stockpriceutility import StockPriceUtility
 
 @dataclass
@@ -27,6 +34,8 @@ class Lot:
     invested_amount_metadata: tuple[float, float, float, float] = (0.0, 0,0, 0.0, 0.0)
     peak_value_metadata: tuple[float, float, float, float] = (0.0, 0,0, 0.0, 0.0)
     gross_proceeds_holdings: float = 0.0
+    # Day ordinal of the credit
+    acquired: int = 0
 
 @dataclass
 class CapitalGain:
@@ -43,16 +52,70 @@ class CapitalGain:
 
 class TransactionProcessor:
 
-    def __init__(self, accounts, transactions):
+    def __init__(self, accounts, transactions, exchange_rate_util=None, price_store=None, # pylint: disable=R0913
+                 checkpoint_store=None, *, profiler=None, sink=None, exchange_rate_store=None, snapshot=None):
+        if snapshot is not None:
+            # Market data comes from the MarketSnapshot, or the path of one, unless given otherwise. Nothing is fetched
+            if isinstance(snapshot, str):
+                # Imported here, the snapshot module pulls in pandas through the price store
+                from .snapshot import MarketSnapshot # pylint: disable=C0415
+                snapshot = MarketSnapshot(snapshot)
+            exchange_rate_store = exchange_rate_store or snapshot.exchange_rate_store(profiler)
+            price_store = price_store or snapshot.price_store()
+        self.snapshot = snapshot
         self.accounts = accounts
         self.transactions = transactions
         self.reports_a3 = {}
         self.reports_ltcg = {}
         self.reports_stcg = {}
-        self.stock_split_multiplier = {}
+        # With a ReportSink the records are handed to it as they are produced instead of being kept in the reports
+        self.sink = sink
+        # Stock -> SplitFactors of its splits in the ledger
+        self.split_factors = {}
         self.stock_price_util = {}
-        self.exchange_rate_util = ExchangeRateUtility()
-        self.lots = {}
+        self.peak_series = {}
+        # Instrumentation is off unless a Profiler is given, pass the same one to a custom exchange_rate_util to
+        # include its lookups
+        self.profiler = profiler
+        self._exchange_rate_util = exchange_rate_util
+        # Rates of the other currencies, and of USD too when exchange_rate_util is not given
+        self.exchange_rate_store = exchange_rate_store
+        # Currency of the accounts holding each stock, a stock is priced and converted in it
+        self.stock_currency = {}
+        self.price_store = price_store
+        self.checkpoint_store = checkpoint_store
+        self.prefetch_report = None
+        # Seconds spent waiting on market data versus processing in generate_reports
+        self.timings = {"io": 0.0, "compute": 0.0}
+        self.lots = LotBook()
+        # Per lot (day of CY, balance) whenever the balance changes during the CY
+        self.balance_history = {}
+
+    @property
+    def exchange_rate_util(self):
+        # Rates are downloaded on first use, not when the processor is constructed
+        if self._exchange_rate_util is None and self.exchange_rate_store is not None:
+            self._exchange_rate_util = self.exchange_rate_store.get(DEFAULT_CURRENCY)
+        elif self._exchange_rate_util is None:
+            self._exchange_rate_util = ExchangeRateUtility(profiler=self.profiler)
+        return self._exchange_rate_util
+
+    def _currency_rates(self, currency):
+        if currency == DEFAULT_CURRENCY:
+            return self.exchange_rate_util
+        if self.exchange_rate_store is None:
+            self.exchange_rate_store = ExchangeRateStore(profiler=self.profiler)
+        return self.exchange_rate_store.get(currency)
+
+    def _rates(self, stock):
+        return self._currency_rates(self.stock_currency.get(stock, DEFAULT_CURRENCY))
+
+    def _set_currency(self, transaction):
+        account = transaction.account
+        currency = account.currency.upper() if account is not None and account.currency else DEFAULT_CURRENCY
+        if self.stock_currency.setdefault(transaction.stock, currency) != currency:
+            assert 0, f"Stock {transaction.stock} is held in both {self.stock_currency[transaction.stock]} and " \
+                      f"{currency} accounts"
 
     def _identify_fy(self, date):
         year, month, _ = date.split("-")
@@ -61,19 +124,38 @@ class TransactionProcessor:
         return str(int(year) + 1)
 
     def _pre_processing(self):
-        self.stock_split_multiplier = {}
+        self.stock_currency = {}
+        splits = {}
+        credit_dates = {}
+        gain_dates = {}
         for transaction in self.transactions:
-            self.stock_split_multiplier.setdefault(transaction.stock, 1)
             if transaction.transaction_type == TransactionType.SPLIT:
-                self.stock_split_multiplier[transaction.stock] *= transaction.units
+                splits.setdefault(transaction.stock, []).append((transaction.ordinal, transaction.units))
+                continue
+            self._set_currency(transaction)
+            if transaction.transaction_type == TransactionType.CREDIT:
+                credit_dates[(transaction.stock, transaction.lot_id)] = transaction.date
+            else:
+                gain_dates.setdefault(self.stock_currency[transaction.stock], set()).update([
+                    transaction.date, credit_dates.get((transaction.stock, transaction.lot_id), transaction.date)
+                ])
+        self.split_factors = {stock: SplitFactors(stock_splits) for stock, stock_splits in splits.items()}
+        # Month end rates of every sale and acquisition are resolved at once, capital gains then hit the memo. Only
+        # the currencies the ledger holds are loaded
+        for currency, dates in gain_dates.items():
+            self._currency_rates(currency).get_exchange_rates_last_month(sorted(dates))
 
     def get_peak_stock_price(self, stock, date):
         price, meta_data = self.stock_price_util[stock].get_peak_price(date)
-        return price * self.stock_split_multiplier[stock], meta_data
+        factor = self.split_factors.get(stock, NO_SPLITS).factor(datetime.fromisoformat(date).toordinal())
+        return price * factor, meta_data
 
     def get_closing_stock_price(self, stock):
-        price, meta_data = self.stock_price_util[stock].get_closing()
-        return price * self.stock_split_multiplier[stock], meta_data
+        stock_price_util = self.stock_price_util[stock]
+        price, meta_data = stock_price_util.get_closing()
+        factor = self.split_factors.get(stock, NO_SPLITS).factor(
+            datetime.fromisoformat(stock_price_util.end_date).toordinal())
+        return price * factor, meta_data
 
     def _identify_cy(self, date):
         return date.split("-")[0]
@@ -82,24 +164,25 @@ class TransactionProcessor:
         return datetime.strptime(date, "%Y-%m-%d")
 
     def _process_credit_transaction(self, t1, curr_date):
-        exchange_rate, exchange_rate_date = self.exchange_rate_util.get_exchange_rate(str(curr_date.date()))
+        exchange_rate, exchange_rate_date = self._rates(t1.stock).get_exchange_rate_ordinal(curr_date.toordinal())
         invested_amount = round(t1.units * t1.buy_price * exchange_rate, 2)
-        self.lots[t1.stock + "_" + t1.lot_id] = Lot(
+        return self.lots.add(Lot(
             lot_id=t1.lot_id,
             balance=t1.units,
             stock=t1.stock,
             invested_amount=invested_amount,
             invested_amount_metadata = (t1.buy_price, str(curr_date.date()), exchange_rate, exchange_rate_date),
             peak_value=invested_amount,
-            peak_value_metadata = (t1.buy_price, str(curr_date.date()), exchange_rate, exchange_rate_date)
-        )
+            peak_value_metadata = (t1.buy_price, str(curr_date.date()), exchange_rate, exchange_rate_date),
+            acquired=t1.ordinal
+        ))
 
     def _process_capital_gain(self, t1, lot):
         cost_of_acquisition = lot.invested_amount_metadata[0] * t1.units
         total_value_of_consideration = t1.sell_price * t1.units
-        exchange_rate_acquisition = self.exchange_rate_util.get_exchange_rate_last_month(
-            lot.invested_amount_metadata[1])
-        exchange_rate_sale = self.exchange_rate_util.get_exchange_rate_last_month(t1.date)
+        exchange_rate_util = self._rates(t1.stock)
+        exchange_rate_acquisition = exchange_rate_util.get_exchange_rate_last_month(lot.invested_amount_metadata[1])
+        exchange_rate_sale = exchange_rate_util.get_exchange_rate_last_month(t1.date)
         cg = CapitalGain(
             lot_id=lot.lot_id,
             stock=t1.stock,
@@ -112,85 +195,236 @@ class TransactionProcessor:
             sell_metadata=(t1.sell_price, t1.date) + exchange_rate_sale
         )
         cg.gain = round(cg.total_value_of_consideration_inr - cg.cost_of_acquisition_inr, 2)
-        difference = relativedelta(
-            datetime.strptime(t1.date, "%Y-%m-%d"),
-            datetime.strptime(lot.invested_amount_metadata[1], "%Y-%m-%d")
-        )
-        fy = self._identify_fy(t1.date)
-        if difference.years > 3:
-            self.reports_ltcg.setdefault(fy, []).append(cg)
-        else:
-            self.reports_stcg.setdefault(fy, []).append(cg)
+        difference = relativedelta(datetime.fromordinal(t1.ordinal), datetime.fromordinal(lot.acquired))
+        self._emit("ltcg" if difference.years > 3 else "stcg", self._identify_fy(t1.date), lot.lot_id, cg)
 
     def _process_debit_transaction(self, t1, curr_date):
-        exchange_rate, _ = self.exchange_rate_util.get_exchange_rate(str(curr_date.date()))
-        lot = self.lots[t1.stock + "_" + t1.lot_id]
+        exchange_rate, _ = self._rates(t1.stock).get_exchange_rate_ordinal(curr_date.toordinal())
+        lot = self.lots.get(t1.stock, t1.lot_id)
         gross_proceeds_holdings = round(t1.units * t1.sell_price * exchange_rate, 2)
         lot.balance -= t1.units
         lot.gross_proceeds_holdings += gross_proceeds_holdings
+        self.lots.refresh(lot)
         self._process_capital_gain(t1, lot)
+        return lot
 
     def _process_split_transaction(self, t1):
-        for _, lot in self.lots.items():
-            if lot.stock != t1.stock:
-                continue
+        # Closed lots have no balance to split
+        for _, lot in self.lots.open_lots(t1.stock):
             lot.balance *= t1.units
-        self.stock_split_multiplier[t1.stock] /= t1.units
 
     def _init_stock_price_util(self, stock, start_date, end_date):
         if stock in self.stock_price_util:
             return
+        start = time.perf_counter()
         self.stock_price_util[stock] = StockPriceUtility(stock, str(start_date.date()), \
-                                    str(end_date.date()), self.exchange_rate_util)
+                                    str(end_date.date()), self._rates(stock), self.price_store, \
+                                    profiler=self.profiler)
+        self.timings["io"] += time.perf_counter() - start
+
+    def _record_balance(self, key, lot, day):
+        history = self.balance_history.setdefault(key, [])
+        entry = (day, lot.balance)
+        # Peak is evaluated after all the transactions of the day, only the last state of the day matters
+        if history and history[-1][0] == day:
+            history[-1] = entry
+        else:
+            history.append(entry)
+
+    def _process_transaction(self, t1, curr_date, day):
+        if t1.transaction_type==TransactionType.CREDIT:
+            key = self._process_credit_transaction(t1, curr_date)
+            self.balance_history.pop(key, None)
+            self._record_balance(key, self.lots.active[key], day)
+        if t1.transaction_type==TransactionType.DEBIT:
+            key = (t1.stock, t1.lot_id)
+            if key not in self.balance_history:
+                # Lot archived earlier and brought back by this debit, it held nothing until today
+                self.balance_history[key] = [(0, 0)]
+            lot = self._process_debit_transaction(t1, curr_date)
+            self._record_balance(key, lot, day)
+        if t1.transaction_type==TransactionType.SPLIT:
+            self._process_split_transaction(t1)
+            for key, lot in self.lots.open_lots(t1.stock):
+                self._record_balance(key, lot, day)
+
+    def _update_peak_values(self, start_date, end_date):
+        days = (end_date - start_date).days + 1
+        for key, lot in self.lots.items():
+            self._init_stock_price_util(lot.stock, start_date, end_date)
+            if lot.stock not in self.peak_series:
+                self.peak_series[lot.stock] = PeakSeries(self.stock_price_util[lot.stock], start_date, end_date,
+                                                         self.split_factors.get(lot.stock, NO_SPLITS))
+            series = self.peak_series[lot.stock]
+            history = self.balance_history[key]
+            for idx, (day, balance) in enumerate(history):
+                next_day = history[idx + 1][0] if idx + 1 < len(history) else days
+                peak, meta_data = series.get_peak_value(balance, day, next_day)
+                if peak > lot.peak_value:
+                    lot.peak_value = peak
+                    lot.peak_value_metadata = meta_data
+            if self.profiler is not None:
+                # Lot days the day by day loop would have iterated, against the constant balance ranges evaluated
+                self.profiler.count("peak.lot_days", days)
+                self.profiler.count("peak.ranges", len(history))
+
+    def _emit(self, kind, period, lot_id, record):
+        if self.sink is not None:
+            self.sink.write(kind, period, lot_id, record)
+        elif kind == "a3":
+            self.reports_a3[period][lot_id] = record
+        elif kind == "ltcg":
+            self.reports_ltcg.setdefault(period, []).append(record)
+        else:
+            self.reports_stcg.setdefault(period, []).append(record)
+
+    def _generate_a3(self, year):
+        if self.sink is None:
+            self.reports_a3[year] = {}
+        for _, lot in self.lots.items():
+            price, meta_data = self.get_closing_stock_price(lot.stock)
+            self._emit("a3", year, lot.lot_id, ReportA3(
+                invested_amount=lot.invested_amount,
+                peak_value=lot.peak_value,
+                gross_proceeds_holdings=lot.gross_proceeds_holdings,
+                closing_balance=round(lot.balance * price, 2),
+                closing_balance_metadata=meta_data,
+                peak_value_metadata=lot.peak_value_metadata,
+                invested_amount_metadata=lot.invested_amount_metadata
+            ))
+            # Reset lot for next CY
+            lot.peak_value = -1.0
+            lot.gross_proceeds_holdings = 0.0
+
+    def _restore(self, state, count, t1, transactions):
+        # Skip the transactions already covered by the checkpoint
+        self.lots = state["lots"]
+        self.reports_a3 = state["reports_a3"]
+        self.reports_ltcg = state["reports_ltcg"]
+        self.reports_stcg = state["reports_stcg"]
+        for _ in range(count):
+            t1 = next(transactions, None)
+        return t1
+
+    def _save_checkpoint(self, year, digest):
+        self.checkpoint_store.save(year, digest, {
+            "lots": self.lots,
+            "reports_a3": self.reports_a3,
+            "reports_ltcg": self.reports_ltcg,
+            "reports_stcg": self.reports_stcg,
+        })
+
+    def _phase(self, year, name):
+        return self.profiler.phase(year, name) if self.profiler is not None else nullcontext()
 
     def generate_reports(self):
+        for _ in self._generate_years():
+            pass
+        return self.reports_a3, self.reports_ltcg, self.reports_stcg
+
+    def iter_reports(self):
+        """
+        Generator variant of generate_reports, yields (kind, period, lot_id, record) as in ReportSink.write. The
+        records of a CY are yielded as soon as it is processed and are not kept in the reports
+        """
+        records = []
+        sink, self.sink = self.sink, CallbackSink(lambda *record: records.append(record))
+        try:
+            for _ in self._generate_years():
+                yield from records
+                records.clear()
+        finally:
+            self.sink = sink
+
+    def _process_year(self, year, t1, transactions):
+        # Returns the first transaction of the following CYs
+        start_date = self._get_time(f"{year}-01-01")
+        end_date = self._get_time(f"{year}-12-31")
+        self.stock_price_util = {}
+        self.peak_series = {}
+        self.balance_history = {}
+        for key, lot in self.lots.items():
+            self._record_balance(key, lot, 0)
+
+        # Process transactions of this CY, peak values are then computed per lot over the date ranges where
+        # the balance stayed constant
+        with self._phase(year, "transactions"):
+            date_ordinal = curr_date = day = None
+            while t1 is not None:
+                # Each transaction parses its date into a day ordinal once, it is not parsed again here
+                ordinal = t1.ordinal
+                if ordinal > end_date.toordinal():
+                    break
+                if ordinal != date_ordinal:
+                    # Transactions of a date are consecutive, it is resolved once for all of them
+                    date_ordinal = ordinal
+                    curr_date = datetime.fromordinal(ordinal)
+                    day = ordinal - start_date.toordinal()
+                self._process_transaction(t1, curr_date, day)
+                t1 = next(transactions, None)
+
+        # Update peak value
+        with self._phase(year, "peak"):
+            self._update_peak_values(start_date, end_date)
+
+        # Generate A3
+        with self._phase(year, "a3"):
+            self._generate_a3(year)
+        # Lots closed by now are not reported in the following CYs
+        self.lots.archive_closed()
+        return t1
+
+    def _generate_years(self):
+        if self.sink is not None and self.checkpoint_store is not None:
+            # Records are not kept with a sink, a resumed run could not send the CYs before its checkpoint again
+            assert 0, "A report sink cannot be combined with a checkpoint store"
         # Get CY from the first transaction
         self._pre_processing()
-        year = int(self._identify_cy(self.transactions[0].date))
-        current_year = int(datetime.now().year)
-        transaction_idx = 0
+        # Transactions are consumed in a single pass, so a streamed ledger never has to be held in memory
+        transactions = iter(self.transactions)
+        t1 = next(transactions, None)
+        if t1 is None:
+            return
+        year = int(self._identify_cy(t1.date))
+        # A snapshot holds market data up to the end of the CY it was created for, reports stop there as well
+        current_year = self.snapshot.current_year if self.snapshot is not None else int(datetime.now().year)
+        start = time.perf_counter()
+        elapsed = 0.0
+        digests = {}
+        if self.checkpoint_store is not None:
+            # Only complete CYs are checkpointed, resume after the latest one whose ledger prefix is unchanged
+            digests = prefix_digests(self.transactions, year, current_year - 1)
+            resume_year, state = self.checkpoint_store.find_latest(digests)
+            if state is not None:
+                t1 = self._restore(state, digests[resume_year][1], t1, transactions)
+                year = resume_year + 1
+        if self.price_store is not None:
+            # Fetch every stock for the whole period up front, StockPriceUtility then reads from the store. A store
+            # warmed up by a Prefetcher already has everything and nothing is fetched here. Exchange rates are left to
+            # the processor, which only loads the currencies the ledger holds
+            prefetcher = Prefetcher(self.price_store, load_exchange_rates=False)
+            with self._phase(year, "prefetch"):
+                prefetcher.run(self.transactions, current_year, year)
+            self.prefetch_report = prefetcher.report
+            self.timings["io"] += prefetcher.report.io_wait
         while year <= current_year:
-            curr_date = start_date = self._get_time(f"{year}-01-01")
-            end_date = self._get_time(f"{year}-12-31")
-            self.stock_price_util = {}
-            while curr_date <= end_date:
-                # Process transactions on this date
-                while(transaction_idx < len(self.transactions) and \
-                    self._get_time(self.transactions[transaction_idx].date) == curr_date):
-                    t1 = self.transactions[transaction_idx]
-                    if t1.transaction_type==TransactionType.CREDIT:
-                        self._process_credit_transaction(t1, curr_date)
-                    if t1.transaction_type==TransactionType.DEBIT:
-                        self._process_debit_transaction(t1, curr_date)
-                    if t1.transaction_type==TransactionType.SPLIT:
-                        self._process_split_transaction(t1)
-                    transaction_idx += 1
-
-                # Update peak value
-                for _, lot in self.lots.items():
-                    self._init_stock_price_util(lot.stock, start_date, end_date)
-                    price, meta_data = self.get_peak_stock_price(lot.stock, str(curr_date.date()))
-                    todays_peak = round(lot.balance * price, 2)
-                    if todays_peak > lot.peak_value:
-                        lot.peak_value = todays_peak
-                        lot.peak_value_metadata = meta_data
-                curr_date += timedelta(days=1)
-
-            # Generate A3
-            self.reports_a3[year] = {}
-            for _, lot in self.lots.items():
-                price, meta_data = self.get_closing_stock_price(lot.stock)
-                self.reports_a3[year][lot.lot_id] = ReportA3(
-                    invested_amount=lot.invested_amount,
-                    peak_value=lot.peak_value,
-                    gross_proceeds_holdings=lot.gross_proceeds_holdings,
-                    closing_balance=round(lot.balance * price, 2),
-                    closing_balance_metadata=meta_data,
-                    peak_value_metadata=lot.peak_value_metadata,
-                    invested_amount_metadata=lot.invested_amount_metadata
-                )
-                # Reset lot for next CY
-                lot.peak_value = -1
-                lot.gross_proceeds_holdings = 0
+            if len(self.lots) == 0:
+                # Nothing is held until the CY of the next transaction, the CYs in between have nothing to report
+                next_year = current_year + 1 if t1 is None else min(int(self._identify_cy(t1.date)), current_year + 1)
+                if next_year > year:
+                    if self.sink is None:
+                        self.reports_a3.update({empty_year: {} for empty_year in range(year, next_year)})
+                    year = next_year
+                    continue
+            t1 = self._process_year(year, t1, transactions)
+            if year in digests:
+                with self._phase(year, "checkpoint"):
+                    self._save_checkpoint(year, digests[year][0])
+            if self.sink is not None:
+                self.sink.flush()
+            # Time the consumer spends between CYs is not counted
+            elapsed += time.perf_counter() - start
+            self.timings["compute"] = elapsed - self.timings["io"]
+            yield year
+            start = time.perf_counter()
             year += 1
-        return self.reports_a3, self.reports_ltcg, self.reports_stcg
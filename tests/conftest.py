@@ -0,0 +1,14 @@
+import pytest
+
+from src import transactionprocessor
+from tests.fakes import FakeExchangeRateUtility, FakeTicker, sample_transactions
+
+@pytest.fixture
+def transactions():
+    yield sample_transactions()
+
+@pytest.fixture
+def offline(monkeypatch):
+    # USD rates and yfinance prices are served by the fakes
+    monkeypatch.setattr(transactionprocessor, "ExchangeRateUtility", FakeExchangeRateUtility)
+    monkeypatch.setattr("yfinance.Ticker", FakeTicker)
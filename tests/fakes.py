@@ -0,0 +1,243 @@
+# pylint: disable=duplicate-code
+"""
+Offline stand-ins for the market data sources and the day by day loop the peak engine replaced, shared by the tests
+of TransactionProcessor
+"""
+from datetime import datetime, timedelta
+import random
+
+from dateutil.relativedelta import relativedelta
+import numpy as np
+import pandas as pd
+
+from src.ledger import Transaction, TransactionType
+from src.pricestore import PriceProvider
+from src.transactionprocessor import CapitalGain, Lot, ReportA3
+
+class FakeExchangeRateUtility:
+
+    def __init__(self, profiler=None, base=70):
+        self.profiler = profiler
+        self.base = base
+
+    def get_exchange_rate(self, date):
+        date_stamp = datetime.strptime(date, "%Y-%m-%d")
+        # Weekends fall back to Friday, like the SBI table
+        while date_stamp.weekday() >= 5:
+            date_stamp -= timedelta(days=1)
+        return self.base + date_stamp.toordinal() % 17 / 7, str(date_stamp.date())
+
+    def get_exchange_rate_ordinal(self, ordinal):
+        return self.get_exchange_rate(str(datetime.fromordinal(ordinal).date()))
+
+    def get_exchange_rates(self, dates):
+        rates, rate_dates = zip(*[self.get_exchange_rate(date) for date in dates])
+        return np.array(rates), np.array(rate_dates, dtype="datetime64[D]")
+
+    def get_exchange_rate_last_month(self, date):
+        date_stamp = datetime.strptime(date, "%Y-%m-%d").replace(day=1) - timedelta(days=1)
+        return self.get_exchange_rate(str(date_stamp.date()))
+
+    def get_exchange_rates_last_month(self, dates):
+        return [self.get_exchange_rate_last_month(date) for date in dates]
+
+class FakeTicker:
+    requests = []
+
+    def __init__(self, stock):
+        self.stock = stock
+
+    def history(self, start, end, interval):
+        assert interval == "1d"
+        FakeTicker.requests.append((self.stock, start))
+        dates = pd.bdate_range(start, pd.Timestamp(end) - pd.Timedelta(days=1), name="Date")
+        highs = [round(random.Random(f"{self.stock}{date.date()}").uniform(50, 150), 2) for date in dates]
+        return pd.DataFrame({"Open": highs, "High": highs, "Low": highs, "Close": highs}, index=dates)
+
+class FakeProvider(PriceProvider):
+
+    def fetch(self, tickers, start, end):
+        return {ticker: FakeTicker(ticker).history(start, end, "1d") for ticker in tickers}
+
+class LegacyStockPriceUtility:
+    # StockPriceUtility of the baseline, prices straight from yfinance and converted one date at a time
+
+    def __init__(self, stock, start_date, end_date, exchange_rate_util):
+        import yfinance as yf # pylint: disable=C0415
+        self.ticker = yf.Ticker(stock)
+        self.start_date = start_date
+        self.end_date = end_date
+        self.cut_off = datetime.strptime(start_date, "%Y-%m-%d") - timedelta(days=30)
+        self.date_to_peak_price = {}
+        end_date_excluded = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+        rows = self.ticker.history(start=str(self.cut_off.date()), end=str(end_date_excluded.date()),
+                                   interval="1d").reset_index().to_dict(orient='records')
+        assert rows
+        for row in rows:
+            date = str(row['Date'].date())
+            exchange_rate, date_exchange_rate = exchange_rate_util.get_exchange_rate(date)
+            self.date_to_peak_price[date] = (row['High'] * exchange_rate, row['High'], exchange_rate,
+                                             date_exchange_rate)
+        exchange_rate, date_exchange_rate = exchange_rate_util.get_exchange_rate(end_date)
+        self.closing_price = (rows[-1]['Close'] * exchange_rate, rows[-1]['Close'], str(rows[-1]['Date'].date()),
+                              exchange_rate, date_exchange_rate)
+
+    def get_closing(self):
+        return self.closing_price[0], self.closing_price[1:]
+
+    def get_peak_price(self, date):
+        date_stamp = datetime.strptime(date, "%Y-%m-%d")
+        while date_stamp >= self.cut_off:
+            rate = self.date_to_peak_price.get(str(date_stamp.date()))
+            if rate is not None:
+                return rate[0], (rate[1], str(date_stamp.date()), rate[2], rate[3])
+            date_stamp -= timedelta(days=1)
+        assert 0, f"No price for {date}"
+
+class LegacyTransactionProcessor:
+    # Frozen copy of the baseline day by day loop the peak engine replaced, kept as the reference implementation. It
+    # shares nothing with TransactionProcessor but the record dataclasses: lots live in a plain dict and splits are
+    # applied through a running multiplier
+
+    def __init__(self, transactions, exchange_rate_util=None):
+        self.transactions = transactions
+        self.exchange_rate_util = exchange_rate_util or FakeExchangeRateUtility()
+        self.reports_a3 = {}
+        self.reports_ltcg = {}
+        self.reports_stcg = {}
+        self.stock_split_multiplier = {}
+        self.stock_price_util = {}
+        self.lots = {}
+
+    def _identify_fy(self, date):
+        year, month, _ = date.split("-")
+        if int(month) in range(1, 4):
+            return year
+        return str(int(year) + 1)
+
+    def _process_credit_transaction(self, t1, curr_date):
+        exchange_rate, exchange_rate_date = self.exchange_rate_util.get_exchange_rate(str(curr_date.date()))
+        invested_amount = round(t1.units * t1.buy_price * exchange_rate, 2)
+        self.lots[t1.stock + "_" + t1.lot_id] = Lot(
+            lot_id=t1.lot_id,
+            balance=t1.units,
+            stock=t1.stock,
+            invested_amount=invested_amount,
+            invested_amount_metadata=(t1.buy_price, str(curr_date.date()), exchange_rate, exchange_rate_date),
+            peak_value=invested_amount,
+            peak_value_metadata=(t1.buy_price, str(curr_date.date()), exchange_rate, exchange_rate_date)
+        )
+
+    def _process_debit_transaction(self, t1, curr_date):
+        exchange_rate, _ = self.exchange_rate_util.get_exchange_rate(str(curr_date.date()))
+        lot = self.lots[t1.stock + "_" + t1.lot_id]
+        lot.balance -= t1.units
+        lot.gross_proceeds_holdings += round(t1.units * t1.sell_price * exchange_rate, 2)
+        cost_of_acquisition = lot.invested_amount_metadata[0] * t1.units
+        total_value_of_consideration = t1.sell_price * t1.units
+        exchange_rate_acquisition = self.exchange_rate_util.get_exchange_rate_last_month(
+            lot.invested_amount_metadata[1])
+        exchange_rate_sale = self.exchange_rate_util.get_exchange_rate_last_month(t1.date)
+        cg = CapitalGain(
+            lot_id=lot.lot_id,
+            stock=t1.stock,
+            units=t1.units,
+            cost_of_acquisition=cost_of_acquisition,
+            cost_of_acquisition_inr=cost_of_acquisition * exchange_rate_acquisition[0],
+            total_value_of_consideration=total_value_of_consideration,
+            total_value_of_consideration_inr=total_value_of_consideration * exchange_rate_sale[0],
+            buy_metadata=(lot.invested_amount_metadata[0], lot.invested_amount_metadata[1]) + exchange_rate_acquisition,
+            sell_metadata=(t1.sell_price, t1.date) + exchange_rate_sale
+        )
+        cg.gain = round(cg.total_value_of_consideration_inr - cg.cost_of_acquisition_inr, 2)
+        difference = relativedelta(datetime.strptime(t1.date, "%Y-%m-%d"),
+                                   datetime.strptime(lot.invested_amount_metadata[1], "%Y-%m-%d"))
+        reports = self.reports_ltcg if difference.years > 3 else self.reports_stcg
+        reports.setdefault(self._identify_fy(t1.date), []).append(cg)
+
+    def _process_split_transaction(self, t1):
+        for lot in self.lots.values():
+            if lot.stock == t1.stock:
+                lot.balance *= t1.units
+        self.stock_split_multiplier[t1.stock] /= t1.units
+
+    def _stock_price_util(self, stock, start_date, end_date):
+        if stock not in self.stock_price_util:
+            self.stock_price_util[stock] = LegacyStockPriceUtility(stock, str(start_date.date()),
+                                                                   str(end_date.date()), self.exchange_rate_util)
+        return self.stock_price_util[stock]
+
+    def generate_reports(self):
+        for transaction in self.transactions:
+            self.stock_split_multiplier.setdefault(transaction.stock, 1)
+            if transaction.transaction_type == TransactionType.SPLIT:
+                self.stock_split_multiplier[transaction.stock] *= transaction.units
+        year = int(self.transactions[0].date.split("-")[0])
+        transaction_idx = 0
+        while year <= int(datetime.now().year):
+            curr_date = start_date = datetime(year, 1, 1)
+            end_date = datetime(year, 12, 31)
+            self.stock_price_util = {}
+            while curr_date <= end_date:
+                while transaction_idx < len(self.transactions) and \
+                        datetime.strptime(self.transactions[transaction_idx].date, "%Y-%m-%d") == curr_date:
+                    t1 = self.transactions[transaction_idx]
+                    if t1.transaction_type == TransactionType.CREDIT:
+                        self._process_credit_transaction(t1, curr_date)
+                    if t1.transaction_type == TransactionType.DEBIT:
+                        self._process_debit_transaction(t1, curr_date)
+                    if t1.transaction_type == TransactionType.SPLIT:
+                        self._process_split_transaction(t1)
+                    transaction_idx += 1
+                for lot in self.lots.values():
+                    price, meta_data = self._stock_price_util(lot.stock, start_date, end_date).get_peak_price(
+                        str(curr_date.date()))
+                    todays_peak = round(lot.balance * price * self.stock_split_multiplier[lot.stock], 2)
+                    if todays_peak > lot.peak_value:
+                        lot.peak_value = todays_peak
+                        lot.peak_value_metadata = meta_data
+                curr_date += timedelta(days=1)
+            self.reports_a3[year] = {}
+            for lot in self.lots.values():
+                price, meta_data = self._stock_price_util(lot.stock, start_date, end_date).get_closing()
+                self.reports_a3[year][lot.lot_id] = ReportA3(
+                    invested_amount=lot.invested_amount,
+                    peak_value=lot.peak_value,
+                    gross_proceeds_holdings=lot.gross_proceeds_holdings,
+                    closing_balance=round(lot.balance * price * self.stock_split_multiplier[lot.stock], 2),
+                    closing_balance_metadata=meta_data,
+                    peak_value_metadata=lot.peak_value_metadata,
+                    invested_amount_metadata=lot.invested_amount_metadata
+                )
+                lot.peak_value = -1
+                lot.gross_proceeds_holdings = 0
+            year += 1
+        return self.reports_a3, self.reports_ltcg, self.reports_stcg
+
+def make_transaction(date, stock, lot_id, transaction_type, units, **prices):
+    return Transaction(account=None, account_id="1", date=date, stock=stock, lot_id=lot_id,
+                       transaction_type=transaction_type, units=units, buy_price=prices.get("buy_price", 0.0),
+                       sell_price=prices.get("sell_price", 0.0))
+
+def legacy_reports(transactions):
+    reports_a3, reports_ltcg, reports_stcg = LegacyTransactionProcessor(transactions).generate_reports()
+    # Lots closed in an earlier CY are archived and no longer reported
+    for year, reports in reports_a3.items():
+        reports_a3[year] = {
+            lot_id: report for lot_id, report in reports.items()
+            if (report.peak_value, report.closing_balance, report.gross_proceeds_holdings) != (0, 0, 0)
+        }
+    return reports_a3, reports_ltcg, reports_stcg
+
+def sample_transactions():
+    return [
+        make_transaction("2022-03-15", "MSFT", "1", TransactionType.CREDIT, 10, buy_price=90.0),
+        make_transaction("2022-03-15", "MSFT", "2", TransactionType.CREDIT, 5, buy_price=91.5),
+        make_transaction("2022-06-04", "AAPL", "3", TransactionType.CREDIT, 20, buy_price=120.0),
+        make_transaction("2022-08-10", "MSFT", "1", TransactionType.DEBIT, 4, sell_price=110.0),
+        make_transaction("2022-08-10", "MSFT", "2", TransactionType.DEBIT, 5, sell_price=110.0),
+        make_transaction("2023-02-01", "AAPL", "-1", TransactionType.SPLIT, 4),
+        make_transaction("2023-02-01", "AAPL", "4", TransactionType.CREDIT, 8, buy_price=30.0),
+        make_transaction("2023-09-12", "AAPL", "3", TransactionType.DEBIT, 80, sell_price=40.0),
+        make_transaction("2024-01-06", "MSFT", "1", TransactionType.DEBIT, 6, sell_price=130.0),
+    ]
@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+from src.atomicfile import atomic_write
+
+def test_atomic_write(tmp_path):
+    path = os.path.join(tmp_path, "cache", "rates.npy")
+    with atomic_write(path) as f:
+        f.write(b"old")
+    # A failed write leaves the previous file in place and no temporary file behind
+    with pytest.raises(ValueError):
+        with atomic_write(path) as f:
+            f.write(b"partial")
+            raise ValueError
+    with open(path, "rb") as f:
+        assert f.read() == b"old"
+    assert os.listdir(os.path.dirname(path)) == ["rates.npy"]
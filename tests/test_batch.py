@@ -0,0 +1,56 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from src.batch import run_batch
+from src.pricestore import LocalPriceProvider
+
+ACCOUNTS = """account_id,account_no,broker,address,zip_code,country,currency
+1,XX-1001,Broker,1 Main St,98052,US,USD
+"""
+HEADER = "account_id,date,stock,lot_id,transaction_type,units,buy_price,sell_price\n"
+CLIENTS = {
+    "alice": "1,2024-03-15,MSFT,1,credit,10,400.0,\n1,2025-02-10,MSFT,1,debit,4,,410.0\n",
+    "bob": "1,2025-05-02,AAPL,7,credit,3,180.0,\n",
+    # Sells a lot that was never bought
+    "carol": "1,2025-05-02,AAPL,8,debit,3,,180.0\n",
+    # Fails to load
+    "dave": "1,2025-05-02,AAPL,9,credit,ten,180.0,\n",
+}
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+@pytest.fixture
+def clients_dir(tmp_path):
+    dates = pd.bdate_range("2023-11-01", "2026-12-31")
+    for ticker, price in [("MSFT", 400.0), ("AAPL", 180.0)]:
+        pd.DataFrame({"Date": dates, "Open": price, "High": price + 2, "Low": price - 2, "Close": price + 1}) \
+            .to_csv(os.path.join(tmp_path, f"{ticker}.csv"), index=False)
+    write(os.path.join(tmp_path, "SBI_REFERENCE_RATES_USD.csv"),
+          "DATE,PDF_FILE,TT_BUY\n2023-11-01 09:00,a.pdf,83.0\n2025-01-01 09:00,b.pdf,85.5\n")
+    for client, transactions in CLIENTS.items():
+        write(os.path.join(tmp_path, "clients", client, "accounts.csv"), ACCOUNTS)
+        write(os.path.join(tmp_path, "clients", client, "transactions.csv"), HEADER + transactions)
+    yield tmp_path
+
+def test_batch(clients_dir): # pylint: disable=W0621
+    output_dir = os.path.join(clients_dir, "output")
+    results = run_batch(os.path.join(clients_dir, "clients"), output_dir, max_workers=2,
+                        provider=LocalPriceProvider(clients_dir),
+                        rate_path=os.path.join(clients_dir, "SBI_REFERENCE_RATES_USD.csv"),
+                        rate_cache_dir=os.path.join(clients_dir, "cache"),
+                        price_cache_dir=os.path.join(clients_dir, "cache", "prices"))
+    assert [(result.client, result.error is None) for result in results] == \
+        [("alice", True), ("bob", True), ("carol", False), ("dave", False)]
+    assert "ValueError" in results[3].error
+    with open(os.path.join(output_dir, "alice", "a3.json"), encoding="utf-8") as f:
+        reports_a3 = json.load(f)
+    assert reports_a3["2024"]["1"]["peak_value"] == round(10 * 402.0 * 83.0, 2)
+    assert reports_a3["2025"]["1"]["closing_balance"] == round(6 * 401.0 * 85.5, 2)
+    with open(os.path.join(output_dir, "summary.json"), encoding="utf-8") as f:
+        assert [result["client"] for result in json.load(f)] == ["alice", "bob", "carol", "dave"]
@@ -0,0 +1,48 @@
+from dataclasses import replace
+
+import pytest
+
+from src.checkpoint import CheckpointStore, prefix_digests
+from src.exchangerateutility import ExchangeRateStore
+from src.ledger import InvestmentAccount, TransactionType
+from src.transactionprocessor import TransactionProcessor
+from tests.fakes import FakeExchangeRateUtility, FakeTicker, make_transaction
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+def test_checkpoint_resume(transactions, tmp_path):
+    checkpoint_store = CheckpointStore(tmp_path)
+    TransactionProcessor([], transactions, checkpoint_store=checkpoint_store).generate_reports()
+    transactions = transactions + [make_transaction("2025-03-03", "AAPL", "4", TransactionType.DEBIT, 2,
+                                                    sell_price=45.0)]
+    expected = TransactionProcessor([], transactions).generate_reports()
+    FakeTicker.requests.clear()
+    assert TransactionProcessor([], transactions, checkpoint_store=checkpoint_store).generate_reports() == expected
+    # Resumed from the end of 2024, only 2025 onwards is computed again
+    assert FakeTicker.requests and min(start for _, start in FakeTicker.requests) == "2024-12-02"
+
+def test_prefix_digests(transactions):
+    digests = prefix_digests(transactions, 2022, 2025)
+    assert [count for _, count in digests.values()] == [5, 8, 9, 9]
+    # Changing a 2022 transaction invalidates every CY, appending one in 2025 only invalidates 2025
+    changed = prefix_digests([replace(transactions[0], units=11)] + transactions[1:], 2022, 2025)
+    assert all(changed[year][0] != digest for year, (digest, _) in digests.items())
+    appended = prefix_digests(transactions + [make_transaction("2025-03-03", "AAPL", "4", TransactionType.DEBIT, 2,
+                                                               sell_price=45.0)], 2022, 2025)
+    assert [appended[year] == digest for year, digest in digests.items()] == [True, True, True, False]
+
+def test_currency_change(transactions, tmp_path):
+    usd = InvestmentAccount("1", "XX-1001", "Broker", "1 Main St", "98052", "US", "USD")
+    gbp = replace(usd, currency="GBP")
+    exchange_rate_store = ExchangeRateStore()
+    exchange_rate_store.add("GBP", FakeExchangeRateUtility(base=90))
+    checkpoint_store = CheckpointStore(tmp_path)
+    TransactionProcessor([usd], [replace(t, account=usd) for t in transactions],
+                         checkpoint_store=checkpoint_store).generate_reports()
+    in_gbp = [replace(t, account=gbp) for t in transactions]
+    expected = TransactionProcessor([gbp], in_gbp, exchange_rate_store=exchange_rate_store).generate_reports()
+    # Same transactions in a GBP account, the USD checkpoints are not resumed from
+    FakeTicker.requests.clear()
+    assert TransactionProcessor([gbp], in_gbp, checkpoint_store=checkpoint_store,
+                                exchange_rate_store=exchange_rate_store).generate_reports() == expected
+    assert min(start for _, start in FakeTicker.requests) < "2022-01-01"
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from src import cli
+from src.cli import _market_data, _parser, main
+from src.exchangerateutility import ExchangeRateStore
+from src.pricestore import LocalPriceProvider, PriceStore
+from tests.fakes import FakeExchangeRateUtility
+
+ACCOUNTS = """account_id,account_no,broker,address,zip_code,country,currency
+1,XX-1001,Broker,1 Main St,98052,US,USD
+"""
+TRANSACTIONS = """account_id,date,stock,lot_id,transaction_type,units,buy_price,sell_price
+1,2024-03-15,MSFT,1,credit,10,400.0,
+1,2024-06-01,MSFT,-1,split,2,,
+1,2025-02-10,MSFT,1,debit,20,,410.0
+"""
+
+def write_ledger(path, transactions):
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "accounts.csv"), "w", encoding="utf-8") as f:
+        f.write(ACCOUNTS)
+    with open(os.path.join(path, "transactions.csv"), "w", encoding="utf-8") as f:
+        f.write(transactions)
+    return str(path)
+
+def test_validate(tmp_path, capsys):
+    assert main(["validate", write_ledger(tmp_path / "good", TRANSACTIONS)]) == 0
+    ledger = write_ledger(tmp_path / "bad", TRANSACTIONS + "2,2025-03-01,MSFT,1,debit,1,,410.0\n"
+                                                          "1,2025-03-01,AAPL,2,debit,1,,180.0\n")
+    assert main(["validate", ledger, "--streaming"]) == 1
+    assert capsys.readouterr().out.splitlines()[-4:] == [
+        "2025-03-01 AAPL lot 2: debit of a lot that was never credited",
+        "2025-03-01 MSFT lot 1: unknown account 2",
+        # 10 units doubled by the split were all sold
+        "2025-03-01 MSFT lot 1: sells 1 units, only 0 held",
+        "3 problems found",
+    ]
+
+@pytest.mark.parametrize("command", ["load", "validate"])
+def test_no_market_data_imports(tmp_path, command):
+    ledger = write_ledger(tmp_path, TRANSACTIONS)
+    code = f"import sys; from src.cli import main; main(['{command}', {ledger!r}]); " \
+           "assert not {'numpy', 'pandas', 'yfinance'} & set(sys.modules)"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+def test_report_checkpoints_need_json(tmp_path):
+    # Streamed reports are not kept in the checkpoints, a resumed run would drop the earlier CYs
+    with pytest.raises(SystemExit):
+        main(["report", write_ledger(tmp_path, TRANSACTIONS), "--format", "csv", "--checkpoints", str(tmp_path)])
+
+def test_processor_imports_no_pandas():
+    code = "import sys; import src.transactionprocessor; assert not {'pandas', 'yfinance'} & set(sys.modules)"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.dirname(__file__)))
+
+def test_offline_with_local_prices(tmp_path):
+    # --offline only rules out the network, the --prices directory is still read
+    args = _parser().parse_args(["report", str(tmp_path), "--prices", str(tmp_path), "--offline"])
+    _, price_store = _market_data(args)
+    assert not price_store.offline and price_store.provider.path == str(tmp_path)
+    _, price_store = _market_data(_parser().parse_args(["report", str(tmp_path), "--offline"]))
+    assert price_store.offline
+
+def test_prefetch_failures(tmp_path, monkeypatch, capsys):
+    exchange_rate_store = ExchangeRateStore(cache_dir=None)
+    exchange_rate_store.add("USD", FakeExchangeRateUtility())
+    # No MSFT prices in the directory, the fetch fails every retry
+    monkeypatch.setattr(cli, "_market_data", lambda args: (exchange_rate_store,
+                                                           PriceStore(LocalPriceProvider(str(tmp_path)), None)))
+    monkeypatch.setattr("src.prefetch.time.sleep", lambda seconds: None)
+    assert main(["prefetch", write_ledger(tmp_path / "ledger", TRANSACTIONS)]) == 1
+    output = capsys.readouterr().out.splitlines()
+    assert output[0] == "Failed to fetch prices MSFT" and output[1].endswith("3 retries, 1 failures")
@@ -0,0 +1,116 @@
+from datetime import timedelta
+import os
+import pandas as pd
+import pytest
+
+from src.exchangerateutility import ExchangeRateStore, ExchangeRateUtility
+from src.profiler import Profiler
+
+UPSTREAM = "https://example.invalid/SBI_REFERENCE_RATES_USD.csv"
+HEADER = "DATE,PDF_FILE,TT_BUY,TT_SELL,BILL_BUY,BILL_SELL,FOREX_TRAVEL_CARD_BUY,FOREX_TRAVEL_CARD_SELL,CN_BUY,CN_SELL"
+ROWS = [
+    "2023-01-02 09:00,a.pdf,82.1,83.1,0,0,0,0,0,0",
+    "2023-01-03 09:00,b.pdf,82.3,83.3,0,0,0,0,0,0",
+    "2023-01-04 09:00,c.pdf,0,0,0,0,0,0,0,0",
+    "2023-01-06 09:00,d.pdf,82.6,83.6,0,0,0,0,0,0",
+]
+
+def write_rates(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join([HEADER] + rows) + "\n")
+
+@pytest.fixture
+def rate_file(tmp_path):
+    path = os.path.join(tmp_path, "SBI_REFERENCE_RATES_USD.csv")
+    write_rates(path, ROWS[:3])
+    yield path
+
+def test_lookup_walks_back(rate_file, tmp_path): # pylint: disable=W0621
+    exchg_rt_utl = ExchangeRateUtility(rate_file, cache_dir=tmp_path)
+    assert exchg_rt_utl.get_exchange_rate("2023-01-03") == (82.3, "2023-01-03")
+    assert exchg_rt_utl.get_exchange_rate("2023-01-05") == (82.3, "2023-01-03")
+    assert exchg_rt_utl.get_exchange_rate_last_month("2023-02-14") == (82.3, "2023-01-03")
+
+def test_profiled_lookups(rate_file, tmp_path): # pylint: disable=W0621
+    profiler = Profiler()
+    exchg_rt_utl = ExchangeRateUtility(rate_file, cache_dir=tmp_path, profiler=profiler)
+    exchg_rt_utl.get_exchange_rate("2023-01-05")
+    exchg_rt_utl.get_exchange_rates(["2023-01-02", "2023-01-04"])
+    assert profiler.counters == {"fx.walk_steps": 3, "fx.batch_dates": 2}
+    assert profiler.timers["fx.get_exchange_rate"][0] == 1
+
+def test_last_month_memo(rate_file, tmp_path): # pylint: disable=W0621
+    write_rates(rate_file, ROWS + ["2023-02-01 09:00,e.pdf,83.0,84.0,0,0,0,0,0,0"])
+    exchg_rt_utl = ExchangeRateUtility(rate_file, cache_dir=tmp_path, memo_size=1)
+    assert exchg_rt_utl.get_exchange_rates_last_month(["2023-02-14", "2023-02-01", "2023-03-31"]) == \
+        [(82.6, "2023-01-06"), (82.6, "2023-01-06"), (83.0, "2023-02-01")]
+    assert exchg_rt_utl.get_exchange_rate_last_month("2023-03-02") == (83.0, "2023-02-01")
+    # Only the most recent month is kept, February was evicted and resolved again
+    assert exchg_rt_utl.get_exchange_rate_last_month("2023-02-28") == (82.6, "2023-01-06")
+    assert exchg_rt_utl.memo.stats() == {"hits": 2, "misses": 3, "size": 1, "maxsize": 1}
+
+def test_store_loads_currencies_on_demand(tmp_path):
+    write_rates(os.path.join(tmp_path, "SBI_REFERENCE_RATES_GBP.csv"), ["2023-01-02 09:00,a.pdf,101.5,0,0,0,0,0,0,0"])
+    exchange_rate_store = ExchangeRateStore(tmp_path, cache_dir=None)
+    assert exchange_rate_store.get("gbp").get_exchange_rate("2023-01-04") == (101.5, "2023-01-02")
+    assert exchange_rate_store.get("GBP") is exchange_rate_store.get("gbp")
+    assert list(exchange_rate_store.utilities) == ["GBP"]
+
+@pytest.fixture
+def upstream(tmp_path, monkeypatch):
+    # Reads of the upstream URL are served from a local file
+    path = os.path.join(tmp_path, "upstream.csv")
+    write_rates(path, ROWS[:3])
+    read_csv = pd.read_csv
+    monkeypatch.setattr(pd, "read_csv", lambda source: read_csv(path if source == UPSTREAM else source))
+    yield path
+
+def test_cache_used_offline(upstream, tmp_path): # pylint: disable=W0621
+    ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path)
+    os.remove(upstream)
+    exchg_rt_utl = ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path, offline=True)
+    assert exchg_rt_utl.get_exchange_rate("2023-01-02") == (82.1, "2023-01-02")
+
+def test_cache_per_source(rate_file, upstream, tmp_path): # pylint: disable=W0621
+    write_rates(upstream, ["2023-01-02 09:00,a.pdf,50.0,0,0,0,0,0,0,0"])
+    other_file = os.path.join(tmp_path, "other", os.path.basename(rate_file))
+    os.makedirs(os.path.dirname(other_file))
+    write_rates(other_file, ["2023-01-02 09:00,a.pdf,60.0,0,0,0,0,0,0,0"])
+    assert ExchangeRateUtility(rate_file, cache_dir=tmp_path).get_exchange_rate("2023-01-02")[0] == 82.1
+    assert ExchangeRateUtility(other_file, cache_dir=tmp_path).get_exchange_rate("2023-01-02")[0] == 60.0
+    assert ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path).get_exchange_rate("2023-01-02")[0] == 50.0
+
+def test_local_file_always_read(rate_file, tmp_path): # pylint: disable=W0621
+    ExchangeRateUtility(rate_file, cache_dir=tmp_path)
+    write_rates(rate_file, ["2023-01-02 09:00,a.pdf,99.9,0,0,0,0,0,0,0"] + ROWS[1:])
+    exchg_rt_utl = ExchangeRateUtility(rate_file, cache_dir=tmp_path, offline=True)
+    assert exchg_rt_utl.get_exchange_rate("2023-01-02") == (99.9, "2023-01-02")
+    assert exchg_rt_utl.get_exchange_rate("2023-01-06") == (82.6, "2023-01-06")
+
+def test_stale_cache_appends_new_rows(upstream, tmp_path): # pylint: disable=W0621
+    ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path)
+    # Rows already cached are kept, only the newer ones are taken from the refreshed file
+    write_rates(upstream, ["2023-01-02 09:00,a.pdf,99.9,0,0,0,0,0,0,0"] + ROWS[1:])
+    exchg_rt_utl = ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path)
+    assert exchg_rt_utl.get_exchange_rate("2023-01-06") == (82.3, "2023-01-03")
+    exchg_rt_utl = ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path, max_age=timedelta(0))
+    assert exchg_rt_utl.get_exchange_rate("2023-01-06") == (82.6, "2023-01-06")
+    assert exchg_rt_utl.get_exchange_rate("2023-01-02") == (82.1, "2023-01-02")
+
+def test_future_rows_do_not_keep_cache_fresh(upstream, tmp_path): # pylint: disable=W0621
+    write_rates(upstream, ROWS[:1] + ["2099-01-02 09:00,z.pdf,1.0,0,0,0,0,0,0,0"])
+    ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path)
+    exchg_rt_utl = ExchangeRateUtility(UPSTREAM, cache_dir=tmp_path, max_age=timedelta(0))
+    assert not exchg_rt_utl._is_fresh() # pylint: disable=W0212
+
+def test_offline_without_cache(tmp_path):
+    with pytest.raises(AssertionError):
+        ExchangeRateUtility("https://example.invalid/rates.csv", cache_dir=tmp_path, offline=True)
+
+def test_batch_lookup(rate_file, tmp_path): # pylint: disable=W0621
+    exchg_rt_utl = ExchangeRateUtility(rate_file, cache_dir=tmp_path)
+    rates, dates = exchg_rt_utl.get_exchange_rates(["2023-01-02", "2023-01-04", "2023-03-01"])
+    assert rates.tolist() == [82.1, 82.3, 82.3]
+    assert dates.astype(str).tolist() == ["2023-01-02", "2023-01-03", "2023-01-03"]
+    with pytest.raises(AssertionError):
+        exchg_rt_utl.get_exchange_rates(["2023-01-01"])
@@ -0,0 +1,63 @@
+from dataclasses import replace
+import os
+
+import pytest
+
+from src.ledger import ColumnarLedger, LedgerLoader, StreamingLedgerLoader, validate_transactions
+
+ACCOUNTS = """account_id,account_no,broker,address,zip_code,country,currency
+1,XX-1001,Broker,1 Main St,98052,US,USD
+"""
+TRANSACTIONS = {
+    "rsu.csv": """account_id,date,stock,lot_id,transaction_type,units,buy_price,sell_price
+1,2023-03-15,MSFT,1,credit,10,250.5,
+1,2022-06-15,MSFT,2,credit,4,260.0,
+1,2023-03-15,MSFT,2,debit,4,,280.0
+
+1,2022-07-18,GOOG,3,credit,2,2200.0,
+
+""",
+    "espp.csv": """account_id,date,stock,lot_id,transaction_type,units,buy_price,sell_price
+1,2022-07-18,GOOG,-1,split,20,,
+1,2023-03-15,MSFT,4,credit,6,240.0,
+1,2021-12-31,AAPL,5,credit,8,170.0,
+""",
+}
+
+@pytest.fixture
+def ledger_dir(tmp_path):
+    with open(os.path.join(tmp_path, "accounts.csv"), "w", encoding="utf-8") as f:
+        f.write(ACCOUNTS)
+    for filename, content in TRANSACTIONS.items():
+        with open(os.path.join(tmp_path, filename), "w", encoding="utf-8") as f:
+            f.write(content)
+    yield tmp_path
+
+@pytest.mark.parametrize("reader", ["csv", "pandas", "pyarrow"])
+def test_streaming_matches_loader(ledger_dir, reader): # pylint: disable=W0621
+    if reader == "pyarrow":
+        pytest.importorskip("pyarrow")
+    expected = LedgerLoader(ledger_dir).get_transactions()
+    with StreamingLedgerLoader(ledger_dir, chunk_size=2, reader=reader) as loader:
+        assert len(loader.run_paths) == 4
+        assert list(loader.get_transactions()) == expected
+        # The stream can be iterated again
+        assert list(loader.get_transactions()) == expected
+        assert [account.account_no for account in loader.get_accounts()] == ["XX-1001"]
+        assert all(transaction.account is loader.get_accounts()[0] for transaction in loader.get_transactions())
+
+def test_columnar_ledger(ledger_dir): # pylint: disable=W0621
+    transactions = LedgerLoader(ledger_dir).get_transactions()
+    ledger = ColumnarLedger(transactions)
+    assert len(ledger) == len(transactions)
+    assert [view.to_transaction() for view in ledger] == transactions
+    assert ledger[-1].date == transactions[-1].date
+    assert ledger.stocks == ["AAPL", "MSFT", "GOOG"]
+    assert ledger.get_column("units").tolist() == [transaction.units for transaction in transactions]
+
+def test_validate_dates(ledger_dir): # pylint: disable=W0621
+    transactions = LedgerLoader(ledger_dir).get_transactions()
+    assert not validate_transactions(transactions)
+    for date in ["20230315", "2023-03-15T10:00", "2023-3-15", "2023-02-30"]:
+        problems = validate_transactions([replace(transactions[0], date=date)])
+        assert problems == [f"{date} AAPL lot 5: invalid date"]
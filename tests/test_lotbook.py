@@ -0,0 +1,63 @@
+import pytest
+
+from src.ledger import TransactionType
+from src.lotbook import LotBook
+from src.transactionprocessor import Lot, TransactionProcessor
+from tests.fakes import make_transaction
+
+def make_lot(stock, lot_id, balance):
+    return Lot(lot_id=lot_id, balance=balance, stock=stock, invested_amount=0.0, peak_value=0.0)
+
+@pytest.fixture
+def book():
+    lots = LotBook()
+    for lot in [make_lot("MSFT", "1", 10), make_lot("MSFT", "2", 5), make_lot("AAPL", "3", 4)]:
+        lots.add(lot)
+    lot = lots.get("MSFT", "2")
+    lot.balance = 0
+    lots.refresh(lot)
+    yield lots
+
+def test_partitions(book): # pylint: disable=W0621
+    assert [key for key, _ in book.open_lots("MSFT")] == [("MSFT", "1")]
+    assert list(book.closed) == [("MSFT", "2")]
+    # A lot closed during the CY is still reported for it
+    assert len(book) == 3 and ("MSFT", "2") in book
+
+def test_archive_at_cy_boundary(book): # pylint: disable=W0621
+    book.archive_closed()
+    assert [key for key, _ in book.items()] == [("MSFT", "1"), ("AAPL", "3")]
+    assert list(book.archived) == [("MSFT", "2")] and not book.closed
+    assert [key for key, _ in book.open_lots("MSFT")] == [("MSFT", "1")]
+
+def test_get_brings_back_archived_lot(book): # pylint: disable=W0621
+    book.archive_closed()
+    lot = book.get("MSFT", "2")
+    assert lot.balance == 0 and ("MSFT", "2") in book and not book.archived
+    with pytest.raises(KeyError):
+        book.get("MSFT", "9")
+
+def test_recredit_reopens_lot(book): # pylint: disable=W0621
+    book.add(make_lot("MSFT", "2", 7))
+    assert not book.closed
+    assert [key for key, _ in book.open_lots("MSFT")] == [("MSFT", "1"), ("MSFT", "2")]
+    # Re-credited after it was archived, the lot is reported again
+    book.get("MSFT", "2").balance = 0
+    book.refresh(book.get("MSFT", "2"))
+    book.archive_closed()
+    book.add(make_lot("MSFT", "2", 3))
+    assert not book.archived and not book.closed and book.get("MSFT", "2").balance == 3
+
+@pytest.mark.usefixtures("offline")
+def test_split_touches_open_lots_only():
+    ledger = [
+        make_transaction("2022-03-15", "MSFT", "1", TransactionType.CREDIT, 10, buy_price=90.0),
+        make_transaction("2022-03-15", "MSFT", "2", TransactionType.CREDIT, 5, buy_price=90.0),
+        make_transaction("2022-03-15", "AAPL", "3", TransactionType.CREDIT, 4, buy_price=120.0),
+        make_transaction("2022-05-02", "MSFT", "2", TransactionType.DEBIT, 5, sell_price=95.0),
+        make_transaction("2022-06-01", "MSFT", "-1", TransactionType.SPLIT, 2),
+    ]
+    processor = TransactionProcessor([], ledger)
+    processor.generate_reports()
+    lots = {**processor.lots.active, **processor.lots.archived}
+    assert {lot_id: lot.balance for (_, lot_id), lot in lots.items()} == {"1": 20, "2": 0, "3": 4}
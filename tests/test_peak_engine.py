@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from src.ledger import ColumnarLedger
+from src.pricestore import PriceStore
+from src.peakengine import SplitFactors
+from src.transactionprocessor import TransactionProcessor
+from tests.fakes import FakeProvider, legacy_reports
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+def test_split_factors():
+    # Two splits on the same day and a later one
+    split_factors = SplitFactors([(100, 2), (100, 3), (200, 4)])
+    assert [split_factors.factor(ordinal) for ordinal in [99, 100, 199, 200, 300]] == [24, 4, 4, 1, 1]
+    assert split_factors.factors_for(np.array([99, 100, 199, 200, 300])).tolist() == [24, 4, 4, 1, 1]
+
+def test_matches_day_by_day_loop(transactions):
+    assert TransactionProcessor([], transactions).generate_reports() == legacy_reports(transactions)
+
+def test_price_store(transactions):
+    expected = TransactionProcessor([], transactions).generate_reports()
+    price_store = PriceStore(FakeProvider(), cache_dir=None)
+    assert TransactionProcessor([], transactions, price_store=price_store).generate_reports() == expected
+
+def test_columnar_ledger(transactions):
+    expected = TransactionProcessor([], transactions).generate_reports()
+    assert TransactionProcessor([], ColumnarLedger(transactions)).generate_reports() == expected
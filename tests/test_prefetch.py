@@ -0,0 +1,56 @@
+import pandas as pd
+import pytest
+
+from src.ledger import Transaction, TransactionType
+from src.prefetch import Prefetcher, plan_prefetch
+from src.pricestore import COLUMNS, PriceProvider, PriceStore
+
+class FlakyProvider(PriceProvider):
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def fetch(self, tickers, start, end):
+        self.calls.append((tuple(sorted(tickers)), start, end))
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("temporary failure")
+        return {ticker: pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name="Date")) for ticker in tickers}
+
+@pytest.fixture
+def transactions():
+    yield [
+        Transaction(None, "1", "2022-03-15", "MSFT", "1", TransactionType.CREDIT, 10, 90.0, 0.0),
+        Transaction(None, "1", "2023-02-01", "AAPL", "2", TransactionType.CREDIT, 5, 120.0, 0.0),
+        Transaction(None, "1", "2023-06-01", "MSFT", "3", TransactionType.CREDIT, 5, 100.0, 0.0),
+        Transaction(None, "1", "2023-08-10", "MSFT", "1", TransactionType.DEBIT, 4, 0.0, 110.0),
+    ]
+
+def test_plan(transactions): # pylint: disable=W0621
+    assert plan_prefetch(transactions, 2024) == [("MSFT", 2022), ("MSFT", 2023), ("MSFT", 2024), ("AAPL", 2023),
+                                                 ("AAPL", 2024)]
+
+def test_retry(transactions): # pylint: disable=W0621
+    provider = FlakyProvider(failures=1)
+    prefetcher = Prefetcher(PriceStore(provider, cache_dir=None), exchange_rate_util=object(), backoff=0)
+    prefetcher.run(transactions, 2024)
+    # One range per stock, the failed one is retried
+    assert len(provider.calls) == 3
+    assert set(provider.calls) == {(("MSFT",), "2021-12-02", "2025-01-01"), (("AAPL",), "2022-12-02", "2025-01-01")}
+    assert prefetcher.report.tasks == 2
+    assert prefetcher.report.retries == 1
+
+def test_failure(transactions): # pylint: disable=W0621
+    prefetcher = Prefetcher(PriceStore(FlakyProvider(failures=10), cache_dir=None), exchange_rate_util=object(),
+                            retries=2, backoff=0)
+    with pytest.raises(ConnectionError):
+        prefetcher.run(transactions, 2024)
+    assert prefetcher.report.retries == 4
+    assert len(prefetcher.report.failures) == 2
+
+def test_failure_reported(transactions): # pylint: disable=W0621
+    prefetcher = Prefetcher(PriceStore(FlakyProvider(failures=10), cache_dir=None), exchange_rate_util=object(),
+                            retries=1, backoff=0)
+    prefetcher.run(transactions, 2024, raise_on_failure=False)
+    assert sorted(prefetcher.report.failures) == ["prices AAPL", "prices MSFT"]
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+
+from src.pricestore import LocalPriceProvider, PriceStore, YFinanceProvider
+
+PRICES = {
+    "MSFT": [("2023-01-03", 240.0), ("2023-01-04", 230.5), ("2023-01-05", 226.1), ("2023-01-06", 224.9),
+             ("2023-01-09", 231.0)],
+    "AAPL": [("2023-01-03", 125.1), ("2023-01-04", 126.9), ("2023-01-05", 125.0), ("2023-01-06", 129.6),
+             ("2023-01-09", 130.2)],
+}
+
+class CountingProvider(LocalPriceProvider):
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    def fetch(self, tickers, start, end):
+        self.calls.append((sorted(tickers), start, end))
+        return super().fetch(tickers, start, end)
+
+@pytest.fixture
+def provider(tmp_path):
+    for ticker, prices in PRICES.items():
+        with open(os.path.join(tmp_path, f"{ticker}.csv"), "w", encoding="utf-8") as f:
+            f.write("Date,Open,High,Low,Close\n")
+            for date, price in prices:
+                f.write(f"{date},{price},{price + 1},{price - 1},{price + 0.5}\n")
+    yield CountingProvider(tmp_path)
+
+def test_bulk_fetch_and_reuse(provider, tmp_path): # pylint: disable=W0621
+    cache_dir = os.path.join(tmp_path, "cache")
+    PriceStore(provider, cache_dir).prefetch(["MSFT", "AAPL"], "2023-01-01", "2023-01-07")
+    assert provider.calls == [(["AAPL", "MSFT"], "2023-01-01", "2023-01-07")]
+
+    # A new store reads what is already cached and only asks for the missing dates
+    price_store = PriceStore(provider, cache_dir)
+    history = price_store.get_history("MSFT", "2023-01-04", "2023-01-06")
+    assert len(provider.calls) == 1
+    assert [str(date.date()) for date in history.index] == ["2023-01-04", "2023-01-05"]
+    assert history["High"].tolist() == [231.5, 227.1]
+
+    history = price_store.get_history("AAPL", "2023-01-05", "2023-01-10")
+    assert provider.calls[1] == (["AAPL"], "2023-01-07", "2023-01-10")
+    assert history["Close"].tolist() == [125.5, 130.1, 130.7]
+
+def test_without_cache_dir(provider): # pylint: disable=W0621
+    price_store = PriceStore(provider, cache_dir=None)
+    price_store.prefetch(["MSFT"], "2023-01-01", "2023-01-31")
+    price_store.get_history("MSFT", "2023-01-05", "2023-01-10")
+    assert len(provider.calls) == 1
+
+def test_cache_per_provider(provider, tmp_path): # pylint: disable=W0621
+    cache_dir = os.path.join(tmp_path, "cache")
+    other_dir = os.path.join(tmp_path, "other")
+    os.makedirs(other_dir)
+    with open(os.path.join(other_dir, "MSFT.csv"), "w", encoding="utf-8") as f:
+        f.write("Date,Open,High,Low,Close\n2023-01-04,1.0,2.0,0.5,1.5\n")
+    PriceStore(provider, cache_dir).prefetch(["MSFT"], "2023-01-01", "2023-01-07")
+    history = PriceStore(LocalPriceProvider(other_dir), cache_dir).get_history("MSFT", "2023-01-01", "2023-01-07")
+    assert history["High"].tolist() == [2.0]
+
+def test_revised_ticker_fetched_again(provider, tmp_path): # pylint: disable=W0621
+    cache_dir = os.path.join(tmp_path, "cache")
+    PriceStore(provider, cache_dir).prefetch(["MSFT", "AAPL"], "2023-01-01", "2023-01-05")
+    # MSFT split 2:1, the provider now serves the whole history halved
+    with open(os.path.join(tmp_path, "MSFT.csv"), "w", encoding="utf-8") as f:
+        f.write("Date,Open,High,Low,Close\n")
+        for date, price in PRICES["MSFT"]:
+            f.write(f"{date},{price / 2},{price / 2},{price / 2},{price / 2}\n")
+    os.utime(os.path.join(tmp_path, "MSFT.csv"), (time.time() + 10, time.time() + 10))
+    # Checked within max_age, the cache is used as is
+    PriceStore(provider, cache_dir).get_history("MSFT", "2023-01-01", "2023-01-05")
+    assert len(provider.calls) == 1
+    history = PriceStore(provider, cache_dir, max_age=timedelta(0)).get_history("MSFT", "2023-01-01", "2023-01-10")
+    assert provider.calls[1:] == [(["MSFT"], "2023-01-01", "2023-01-10")]
+    assert history["High"].tolist() == [price / 2 for _, price in PRICES["MSFT"]]
+    # AAPL was not revised, only the new dates are fetched
+    PriceStore(provider, cache_dir, max_age=timedelta(0)).get_history("AAPL", "2023-01-01", "2023-01-10")
+    assert provider.calls[2:] == [(["AAPL"], "2023-01-05", "2023-01-10")]
+
+def test_yfinance_revisions(monkeypatch):
+    class Ticker: # pylint: disable=R0903
+        def __init__(self, ticker):
+            dates = {"MSFT": ["2023-02-15"], "BRK-B": []}[ticker]
+            self.actions = pd.DataFrame({"Dividends": [0.68] * len(dates)}, index=pd.to_datetime(dates))
+
+    monkeypatch.setattr("yfinance.Ticker", Ticker)
+    yfinance = YFinanceProvider()
+    assert yfinance.revised_since("MSFT", datetime(2023, 2, 14, 18).timestamp())
+    assert yfinance.revised_since("MSFT", datetime(2023, 2, 15, 18).timestamp())
+    assert not yfinance.revised_since("MSFT", datetime(2023, 2, 16, 9).timestamp())
+    assert not yfinance.revised_since("BRK-B", datetime(2023, 2, 14).timestamp())
+
+def test_revision_check_persisted(provider, tmp_path): # pylint: disable=W0621
+    checks = []
+    provider.revised_since = lambda ticker, fetched: checks.append(ticker)
+    cache_dir = os.path.join(tmp_path, "cache")
+    PriceStore(provider, cache_dir).prefetch(["MSFT", "AAPL"], "2023-01-01", "2023-01-07")
+    # Warm reruns neither fetch nor check for revisions until max_age has passed
+    for _ in range(2):
+        PriceStore(provider, cache_dir).prefetch(["MSFT", "AAPL"], "2023-01-01", "2023-01-07")
+    assert len(provider.calls) == 1 and not checks
+    # Cached two days ago
+    for ticker in ["MSFT", "AAPL"]:
+        with open(os.path.join(cache_dir, provider.cache_key(), f"{ticker}.json"), encoding="utf-8") as f:
+            metadata = json.load(f)
+        metadata["fetched"] = metadata["checked"] = time.time() - 2 * 86400
+        with open(os.path.join(cache_dir, provider.cache_key(), f"{ticker}.json"), "w", encoding="utf-8") as f:
+            json.dump(metadata, f)
+    PriceStore(provider, cache_dir).prefetch(["MSFT", "AAPL"], "2023-01-01", "2023-01-07")
+    assert checks == ["MSFT", "AAPL"]
+    # The time of that check is kept with the cache
+    PriceStore(provider, cache_dir).prefetch(["MSFT", "AAPL"], "2023-01-01", "2023-01-07")
+    assert checks == ["MSFT", "AAPL"] and len(provider.calls) == 1
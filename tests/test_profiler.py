@@ -0,0 +1,35 @@
+import json
+import os
+
+import pytest
+
+from src.profiler import Profiler
+from src.transactionprocessor import TransactionProcessor
+
+def test_profiler(tmp_path):
+    profiler = Profiler()
+    profiler.count("fx.walk_steps", 3)
+    profiler.count("fx.walk_steps")
+    with profiler.timer("fetch"):
+        pass
+    with profiler.phase(2024, "peak"):
+        pass
+    with profiler.phase(2024, "peak"):
+        pass
+    profiler.write(os.path.join(tmp_path, "profile.json"))
+    with open(os.path.join(tmp_path, "profile.json"), encoding="utf-8") as f:
+        report = json.load(f)
+    assert report["counters"] == {"fx.walk_steps": 4}
+    assert {name: timer["calls"] for name, timer in report["timers"].items()} == {"fetch": 1, "phase.peak": 2}
+    assert list(report["years"]) == ["2024"] and list(report["years"]["2024"]) == ["peak"]
+
+@pytest.mark.usefixtures("offline")
+def test_generate_reports_profiled(transactions):
+    expected = TransactionProcessor([], transactions).generate_reports()
+    profiler = Profiler()
+    assert TransactionProcessor([], transactions, profiler=profiler).generate_reports() == expected
+    report = profiler.report()
+    assert report["counters"]["stock_price_util.constructions"] == report["timers"]["stock_price_util.fetch"]["calls"]
+    assert report["counters"]["peak.lot_days"] > 0
+    assert set(report["years"]) >= {"2022", "2023", "2024"}
+    assert set(report["years"]["2022"]) == {"transactions", "peak", "a3"}
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from src.checkpoint import CheckpointStore
+from src.sinks import SINKS, CallbackSink, ParquetSink
+from src.transactionprocessor import ReportA3, TransactionProcessor
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+def test_iter_reports(transactions):
+    reports_a3, reports_ltcg, reports_stcg = TransactionProcessor([], transactions).generate_reports()
+    streamed = ({}, {}, {})
+    for kind, period, lot_id, record in TransactionProcessor([], transactions).iter_reports():
+        if kind == "a3":
+            streamed[0].setdefault(period, {})[lot_id] = record
+        else:
+            streamed[1 if kind == "ltcg" else 2].setdefault(period, []).append(record)
+    assert streamed == ({year: reports for year, reports in reports_a3.items() if reports}, reports_ltcg, reports_stcg)
+
+def read_rows(path, fmt):
+    if fmt == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+    frame = pd.read_csv(path, dtype=str) if fmt == "csv" else pd.read_parquet(path)
+    return frame.to_dict(orient="records")
+
+@pytest.mark.parametrize("fmt", ["csv", "jsonl", "parquet"])
+def test_sinks(transactions, tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    reports_a3, _, reports_stcg = TransactionProcessor([], transactions).generate_reports()
+    with SINKS[fmt](tmp_path) as sink:
+        processor = TransactionProcessor([], transactions, sink=sink)
+        assert processor.generate_reports() == ({}, {}, {})
+    assert sorted(os.listdir(tmp_path)) == [f"a3.{fmt}", f"stcg.{fmt}"]
+    rows = read_rows(os.path.join(tmp_path, f"a3.{fmt}"), fmt)
+    assert [(str(row["year"]), row["lot_id"], float(row["peak_value"])) for row in rows] == \
+        [(str(year), lot_id, report.peak_value) for year, reports in reports_a3.items()
+         for lot_id, report in reports.items()]
+    rows = read_rows(os.path.join(tmp_path, f"stcg.{fmt}"), fmt)
+    assert [(row["fy"], row["lot_id"], float(row["gain"])) for row in rows] == \
+        [(fy, cg.lot_id, cg.gain) for fy, cgs in reports_stcg.items() for cg in cgs]
+
+def test_iter_reports_keeps_sink(transactions):
+    sink = CallbackSink(lambda *record: None)
+    processor = TransactionProcessor([], transactions, sink=sink)
+    assert list(processor.iter_reports())
+    assert processor.sink is sink
+
+def test_parquet_schema(tmp_path):
+    pytest.importorskip("pyarrow")
+    with ParquetSink(tmp_path) as sink:
+        # Whole numbers in the first row group do not make the column int64
+        sink.write("a3", 2024, "1", ReportA3(0.0, 10.0, 10.0, gross_proceeds_holdings=0))
+        sink.flush()
+        sink.write("a3", 2025, "1", ReportA3(0.0, 10.0, 10.0, gross_proceeds_holdings=64951.98))
+    frame = pd.read_parquet(os.path.join(tmp_path, "a3.parquet"))
+    assert frame["gross_proceeds_holdings"].tolist() == [0.0, 64951.98]
+    assert frame["year"].tolist() == [2024, 2025]
+
+def test_no_checkpoints_with_sink(transactions, tmp_path):
+    # A resumed run could not send the CYs before the checkpoint to the sink again
+    with SINKS["csv"](tmp_path) as sink:
+        processor = TransactionProcessor([], transactions, checkpoint_store=CheckpointStore(tmp_path), sink=sink)
+        with pytest.raises(AssertionError):
+            processor.generate_reports()
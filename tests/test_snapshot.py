@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.exchangerateutility import ExchangeRateStore
+from src.ledger import LedgerLoader
+from src.pricestore import LocalPriceProvider, PriceStore
+from src.snapshot import MarketSnapshot, create_snapshot
+from src.transactionprocessor import TransactionProcessor
+
+ACCOUNTS = """account_id,account_no,broker,address,zip_code,country,currency
+1,XX-1001,Broker,1 Main St,98052,US,USD
+2,XX-2002,Broker,1 High St,EC1,UK,GBP
+"""
+TRANSACTIONS = """account_id,date,stock,lot_id,transaction_type,units,buy_price,sell_price
+1,2024-03-15,MSFT,1,credit,10,400.0,
+2,2024-05-02,VOD,2,credit,100,0.7,
+1,2024-06-01,MSFT,-1,split,2,,
+1,2025-02-10,MSFT,1,debit,20,,410.0
+"""
+
+def write(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+@pytest.fixture
+def market_dir(tmp_path):
+    dates = pd.bdate_range("2024-01-01", "2026-12-31")
+    for idx, ticker in enumerate(["MSFT", "VOD"]):
+        prices = [100 + idx + day % 23 for day in range(len(dates))]
+        pd.DataFrame({"Date": dates, "Open": prices, "High": prices, "Low": prices, "Close": prices}) \
+            .to_csv(os.path.join(tmp_path, f"{ticker}.csv"), index=False)
+    write(os.path.join(tmp_path, "SBI_REFERENCE_RATES_USD.csv"),
+          "DATE,PDF_FILE,TT_BUY\n2023-11-01 09:00,a.pdf,83.0\n2025-01-01 09:00,b.pdf,85.5\n")
+    write(os.path.join(tmp_path, "SBI_REFERENCE_RATES_GBP.csv"),
+          "DATE,PDF_FILE,TT_BUY\n2023-11-01 09:00,a.pdf,104.0\n2024-07-01 09:00,b.pdf,0\n"
+          "2025-01-01 09:00,c.pdf,107.2\n")
+    write(os.path.join(tmp_path, "accounts.csv"), ACCOUNTS)
+    write(os.path.join(tmp_path, "transactions.csv"), TRANSACTIONS)
+    yield str(tmp_path)
+
+def test_round_trip(market_dir, tmp_path): # pylint: disable=W0621
+    loader = LedgerLoader(market_dir)
+
+    def stores():
+        return {"exchange_rate_store": ExchangeRateStore(market_dir, cache_dir=None),
+                "price_store": PriceStore(LocalPriceProvider(market_dir), cache_dir=None)}
+
+    expected = TransactionProcessor(loader.get_accounts(), loader.get_transactions(), **stores()).generate_reports()
+    path = os.path.join(tmp_path, "market.snap")
+    digest = create_snapshot(path, loader.get_accounts(), loader.get_transactions(), **stores())
+
+    snapshot = MarketSnapshot(path)
+    assert snapshot.digest == digest and snapshot.verify()
+    assert snapshot.currencies() == ["GBP", "USD"] and snapshot.tickers() == ["MSFT", "VOD"]
+    # Records are views into the mapping, not copies
+    assert snapshot.prices("MSFT")[0].base is not None
+    # The market data files are gone, the snapshot alone reproduces the reports
+    for name in ["MSFT.csv", "VOD.csv", "SBI_REFERENCE_RATES_USD.csv", "SBI_REFERENCE_RATES_GBP.csv"]:
+        os.remove(os.path.join(market_dir, name))
+    processor = TransactionProcessor(loader.get_accounts(), loader.get_transactions(), snapshot=path)
+    assert processor.generate_reports() == expected
+    # Same market data, same digest
+    assert create_snapshot(os.path.join(tmp_path, "copy.snap"), loader.get_accounts(), loader.get_transactions(),
+                           exchange_rate_store=snapshot.exchange_rate_store(),
+                           price_store=snapshot.price_store()) == digest
+    # Reports stop at the CY the snapshot was created for
+    create_snapshot(os.path.join(tmp_path, "2025.snap"), loader.get_accounts(), loader.get_transactions(),
+                    exchange_rate_store=snapshot.exchange_rate_store(), price_store=snapshot.price_store(),
+                    current_year=2025)
+    reports_a3, _, _ = TransactionProcessor(loader.get_accounts(), loader.get_transactions(),
+                                            snapshot=os.path.join(tmp_path, "2025.snap")).generate_reports()
+    assert list(reports_a3) == [2024, 2025]
+    assert reports_a3[2025] == expected[0][2025]
+
+def test_not_a_snapshot(tmp_path):
+    write(os.path.join(tmp_path, "rates.csv"), "DATE,PDF_FILE,TT_BUY\n")
+    with pytest.raises(AssertionError, match="not a market data snapshot"):
+        MarketSnapshot(os.path.join(tmp_path, "rates.csv"))
@@ -3,8 +3,8 @@ import json
 import os
 import pytest
 
-from stockpriceutility import StockPriceUtility
-from exchangerateutility import ExchangeRateUtility
+from src.stockpriceutility import StockPriceUtility
+from src.exchangerateutility import ExchangeRateUtility
 
 @pytest.fixture
 def test_case_data():
@@ -0,0 +1,63 @@
+from dataclasses import replace
+from datetime import datetime
+
+import pytest
+
+from src.exchangerateutility import ExchangeRateStore
+from src.ledger import InvestmentAccount, TransactionType
+from src.profiler import Profiler
+from src.transactionprocessor import TransactionProcessor
+from tests.fakes import FakeExchangeRateUtility, legacy_reports, make_transaction
+
+pytestmark = pytest.mark.usefixtures("offline")
+
+def test_currency_routing(transactions):
+    account = InvestmentAccount("2", "XX-2002", "Broker", "1 High St", "EC1", "UK", "gbp")
+    aapl_in_gbp = [replace(t, account=account, account_id="2") if t.stock == "AAPL" else t for t in transactions]
+    exchange_rate_store = ExchangeRateStore()
+    exchange_rate_store.add("GBP", FakeExchangeRateUtility(base=90))
+    processor = TransactionProcessor([account], aapl_in_gbp, FakeExchangeRateUtility(),
+                                     exchange_rate_store=exchange_rate_store)
+    reports_a3, _, reports_stcg = processor.generate_reports()
+    assert processor.stock_currency == {"MSFT": "USD", "AAPL": "GBP"}
+    assert {lot_id: report.invested_amount_metadata[2] >= 90 for lot_id, report in reports_a3[2022].items()} == \
+        {"1": False, "2": False, "3": True}
+    assert [cg.buy_metadata[2] >= 90 for cgs in reports_stcg.values() for cg in cgs] == [False, False, True, False]
+    # Only the GBP table was asked of the store
+    assert list(exchange_rate_store.utilities) == ["GBP"]
+
+def test_stock_in_two_currencies(transactions):
+    account = InvestmentAccount("2", "XX-2002", "Broker", "1 High St", "EC1", "UK", "GBP")
+    transactions.append(replace(make_transaction("2024-02-01", "MSFT", "9", transactions[0].transaction_type, 1,
+                                                 buy_price=100.0), account=account, account_id="2"))
+    with pytest.raises(AssertionError, match="held in both USD and GBP"):
+        TransactionProcessor([account], transactions, FakeExchangeRateUtility()).generate_reports()
+
+def test_sparse_ledger():
+    sparse = [
+        make_transaction("2015-05-04", "MSFT", "1", TransactionType.CREDIT, 10, buy_price=50.0),
+        make_transaction("2016-02-01", "MSFT", "1", TransactionType.DEBIT, 10, sell_price=55.0),
+        make_transaction("2024-03-15", "MSFT", "2", TransactionType.CREDIT, 5, buy_price=400.0),
+    ]
+    profiler = Profiler()
+    assert TransactionProcessor([], sparse, profiler=profiler).generate_reports() == \
+        legacy_reports(sparse)
+    # 2017 to 2023 hold nothing and are skipped
+    assert sorted(int(year) for year in profiler.report()["years"]) == \
+        [2015, 2016] + list(range(2024, datetime.now().year + 1))
+
+def test_empty_ledger():
+    assert TransactionProcessor([], []).generate_reports() == ({}, {}, {})
+
+def test_holding_period():
+    ledger = [
+        make_transaction("2016-02-29", "MSFT", "1", TransactionType.CREDIT, 10, buy_price=50.0),
+        make_transaction("2016-02-29", "MSFT", "2", TransactionType.CREDIT, 10, buy_price=50.0),
+        make_transaction("2020-02-28", "MSFT", "1", TransactionType.DEBIT, 10, sell_price=150.0),
+        make_transaction("2020-02-29", "MSFT", "2", TransactionType.DEBIT, 10, sell_price=150.0),
+    ]
+    _, reports_ltcg, reports_stcg = TransactionProcessor([], ledger).generate_reports()
+    assert [cg.lot_id for cg in reports_stcg["2020"]] == ["1"]
+    assert [cg.lot_id for cg in reports_ltcg["2020"]] == ["2"]
+    # Day ordinals are parsed once and kept on the transactions
+    assert all("ordinal" in vars(transaction) for transaction in ledger)